@@ -1,15 +1,18 @@
-from flask import Flask, request, jsonify, render_template, Response
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import json
 import sys
 import os
+import tempfile
 
 # Add the parent directory to the Python path so we can import from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.exception import RAQAMException
+from src.exception import RAQAMException, InvalidInputDataException
 from src.raqam import QuizGenerator
 from src.quiz_config import QuizConfig
-from src.utils import load_config, read_yaml, save_yaml
+from src.utils import load_config, read_yaml, save_yaml, format_stream_frame, STREAM_FORMATS
+from src.jobs import JobRunner, create_job_store
+from src.batch import BatchQuizGenerator, parse_batch_documents
 
 app = Flask(__name__, 
            template_folder='templates',
@@ -17,36 +20,155 @@ app = Flask(__name__,
 
 config = load_config()
 
+# Background generation jobs (bounded worker pool, job store configured in the "jobs" section)
+jobs_config = config.get("jobs", {})
+job_runner = JobRunner(store=create_job_store(store_type=jobs_config.get("store", "memory"),
+                                              path=jobs_config.get("store_path"),
+                                              ttl_hours=jobs_config.get("ttl_hours")),
+                       max_workers=jobs_config.get("workers", 2),
+                       max_pending_jobs=jobs_config.get("max_pending_jobs", 32))
+
 @app.errorhandler(RAQAMException)
 def handle_api_error(error):
     response = jsonify({"error": error.error, "message": error.message, "stack_trace": error.stack_trace})
     response.status_code = error.status_code
     return response
 
+def save_upload_to_temp_file(upload):
+    """
+    Saves a pdf upload to a temporary file (memory mapped by PDFDocument and sent by path to extraction
+    workers, instead of being copied in memory) and returns its path. The caller is responsible for
+    removing the file with remove_temp_file.
+    """
+    file_descriptor, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(file_descriptor)
+    upload.save(path)
+    return path
+
+def remove_temp_file(path):
+    """
+    Removes a temporary file saved by save_upload_to_temp_file, if any
+    """
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
 @app.route("/generate-quiz", methods=["POST"])
 def generate_quiz():
     # Isolating query parameters
+    pdf_path = None
     pdf_file = request.files.get('pdf_file')
     if pdf_file is not None:
-        pdf_file = pdf_file.read()
-    print(request.files)
+        pdf_path = save_upload_to_temp_file(pdf_file)
+    try:
+        print(request.files)
+        data = json.load(request.files.get('data'))
+        print(data)
+        data["pdf_file"] = pdf_path
+        quiz_config = QuizConfig(**config["base_quiz_config"])
+        quiz_config.parse_input_data(data)
+        # Parsing document 
+        quiz_generator = QuizGenerator(**quiz_config.__dict__)
+        # Streaming questions and flashcards as soon as they are generated (?stream=ndjson or ?stream=sse)
+        stream_format = request.args.get("stream")
+        if stream_format in STREAM_FORMATS:
+            frames = quiz_generator.stream_quiz_and_flashcards(generate_quiz=int(data["num_questions"]) > 0,
+                                                               generate_flashcards=bool(data["generate_flashcards"]))
+            response = Response(stream_with_context(format_stream_frame(frame, stream_format) for frame in frames),
+                                mimetype=STREAM_FORMATS[stream_format],
+                                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+            # The pdf is read while streaming: removing it once the response is closed
+            response.call_on_close(lambda path=pdf_path: remove_temp_file(path))
+            pdf_path = None
+            return response
+        output_data = {}
+        quiz, flashcards = quiz_generator.generate_quiz_and_flashcards(generate_quiz=int(data["num_questions"]) > 0,
+                                                                       generate_flashcards=bool(data["generate_flashcards"]))
+        if flashcards is not None:
+            output_data = {**output_data, **flashcards.to_dict()}
+        if quiz is not None:
+            output_data = {**output_data, **quiz.to_dict()}
+        quiz_context = quiz_generator.get_context()
+        output_data["quizContext"] = quiz_context
+        return Response(json.dumps(output_data, indent=4, sort_keys=False), mimetype="application/json")
+    finally:
+        remove_temp_file(pdf_path)
+
+@app.route("/generate-quiz-batch", methods=["POST"])
+def generate_quiz_batch():
+    # Documents reference their pdf upload by form field name ({"pdf_file": "<field name>"})
+    data = json.load(request.files.get('data'))
+    documents_data = parse_batch_documents(data, max_documents=config.get("batch", {}).get("max_documents", 20))
+    quiz_configs = []
+    pdf_paths = []
+    try:
+        for document_data in documents_data:
+            if document_data.get("pdf_file") is not None:
+                pdf_file = request.files.get(document_data["pdf_file"])
+                if pdf_file is None:
+                    raise InvalidInputDataException(message=f"Missing pdf upload {document_data['pdf_file']}")
+                document_data["pdf_file"] = save_upload_to_temp_file(pdf_file)
+                pdf_paths.append(document_data["pdf_file"])
+            quiz_config = QuizConfig(**config["base_quiz_config"])
+            quiz_config.parse_input_data(document_data)
+            quiz_configs.append(quiz_config)
+        outputs = BatchQuizGenerator(quiz_configs=quiz_configs,
+                                     max_concurrency=config["base_quiz_config"].get("max_concurrency")).generate()
+        return Response(json.dumps({"documents": outputs}, indent=4, sort_keys=False), mimetype="application/json")
+    finally:
+        # Removing uploaded pdfs saved for the batch
+        for pdf_path in pdf_paths:
+            remove_temp_file(pdf_path)
+
+def run_generation_job(quiz_config,
+                       generate_quiz,
+                       generate_flashcards,
+                       report_progress,
+                       pdf_path=None):
+    """
+    Generates quiz and flashcards in a job worker and returns the same output as /generate-quiz
+    """
+    try:
+        quiz_generator = QuizGenerator(**quiz_config.__dict__, progress_callback=report_progress)
+        quiz, flashcards = quiz_generator.generate_quiz_and_flashcards(generate_quiz=generate_quiz,
+                                                                       generate_flashcards=generate_flashcards)
+        return quiz_generator.build_output_data(quiz=quiz, flashcards=flashcards)
+    finally:
+        # Removing the uploaded pdf saved for the job
+        remove_temp_file(pdf_path)
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    # Same request as /generate-quiz, generation runs in the background
     data = json.load(request.files.get('data'))
-    print(data)
-    data["pdf_file"] = pdf_file
-    quiz_config = QuizConfig(**config["base_quiz_config"])
-    quiz_config.parse_input_data(data)
-    # Parsing document 
-    quiz_generator = QuizGenerator(**quiz_config.__dict__)
-    output_data = {}
-    if data["generate_flashcards"]:
-        flashcards = quiz_generator.generate_flashcards()
-        output_data = {**output_data, **flashcards.to_dict()}
-    if int(data["num_questions"]) > 0:
-        quiz = quiz_generator.generate_quiz()
-        output_data = {**output_data, **quiz.to_dict()}
-    quiz_context = quiz_generator.get_context()
-    output_data["quizContext"] = quiz_context
-    return Response(json.dumps(output_data, indent=4, sort_keys=False), mimetype="application/json")
+    pdf_path = None
+    pdf_file = request.files.get('pdf_file')
+    if pdf_file is not None:
+        # The upload stream is closed with the request: saving it to a temporary file for the job
+        pdf_path = save_upload_to_temp_file(pdf_file)
+    data["pdf_file"] = pdf_path
+    try:
+        # Invalid requests are rejected right away, before queuing
+        quiz_config = QuizConfig(**config["base_quiz_config"])
+        quiz_config.parse_input_data(data)
+        job_id = job_runner.submit(run_generation_job,
+                                   quiz_config=quiz_config,
+                                   generate_quiz=int(data["num_questions"]) > 0,
+                                   generate_flashcards=bool(data.get("generate_flashcards")),
+                                   pdf_path=pdf_path)
+    except Exception:
+        remove_temp_file(pdf_path)
+        raise
+    return Response(json.dumps({"jobId": job_id, "status": "queued"}), status=202, mimetype="application/json")
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_runner.get(job_id)
+    return Response(json.dumps({"jobId": job["id"],
+                                "status": job["status"],
+                                "stage": job["stage"],
+                                "progress": job["progress"],
+                                "result": job["result"],
+                                "error": job["error"]}, indent=4, sort_keys=False), mimetype="application/json")
 
 @app.route("/quiz-sandbox")
 def quiz_sandbox():
@@ -1,11 +1,9 @@
+import os
 import json
-import base64
 import traceback
 
 from src.exception import RAQAMException
-from src.raqam import QuizGenerator
-from src.quiz_config import QuizConfig
-from src.utils import load_config
+from src.utils import load_config, write_base64_to_temp_file, format_stream_frame
 
 config = load_config()
 
@@ -30,6 +28,7 @@ def get_cors_headers(event):
 
 
 def lambda_handler(event, context):
+    pdf_paths = []
     try:
         cors_headers = get_cors_headers(event)
 
@@ -45,11 +44,45 @@ def lambda_handler(event, context):
         body = json.loads(event["body"])
         data = body.get("data")
 
-        print({key: value for key, value in data.items() if key != "pdf_file"})
+        print({key: value for key, value in data.items() if key not in ["pdf_file", "documents"]})
 
+        # Generation modules (langchain, openai) are imported on the first generation request only,
+        # preflight requests and invalid bodies never pay for them
+        from src.quiz_config import QuizConfig
+        from src.raqam import QuizGenerator
+
+        # Batch of documents sharing embedding batches and LLM concurrency
+        if "documents" in data:
+            from src.batch import BatchQuizGenerator, parse_batch_documents
+
+            quiz_configs = []
+            for document_data in parse_batch_documents(data, max_documents=config.get("batch", {}).get("max_documents", 20)):
+                if document_data.get("pdf_file"):
+                    document_data["pdf_file"] = write_base64_to_temp_file(document_data["pdf_file"], suffix=".pdf")
+                    pdf_paths.append(document_data["pdf_file"])
+                quiz_config = QuizConfig(**config["base_quiz_config"])
+                quiz_config.parse_input_data(document_data)
+                quiz_configs.append(quiz_config)
+
+            outputs = BatchQuizGenerator(
+                quiz_configs=quiz_configs,
+                max_concurrency=config["base_quiz_config"].get("max_concurrency")
+            ).generate()
+
+            return {
+                "statusCode": 200,
+                "headers": {
+                    **cors_headers,
+                    "Content-Type": "application/json"
+                },
+                "body": json.dumps({"documents": outputs}, indent=4, sort_keys=False)
+            }
+
+        # Decoding pdf into a temporary file (memory mapped by PDFDocument) instead of in-memory bytes
         pdf_file = data.get("pdf_file")
         if pdf_file:
-            pdf_file = base64.b64decode(pdf_file)
+            pdf_file = write_base64_to_temp_file(pdf_file, suffix=".pdf")
+            pdf_paths.append(pdf_file)
 
         data["pdf_file"] = pdf_file
 
@@ -57,14 +90,33 @@ def lambda_handler(event, context):
         quiz_config.parse_input_data(data)
 
         quiz_generator = QuizGenerator(**quiz_config.__dict__)
+
+        # Streaming format: same json lines as the Flask API (the Python runtime buffers the response)
+        if data.get("stream") == "ndjson":
+            frames = quiz_generator.stream_quiz_and_flashcards(
+                generate_quiz=int(data.get("num_questions", 0)) > 0,
+                generate_flashcards=bool(data.get("generate_flashcards"))
+            )
+            return {
+                "statusCode": 200,
+                "headers": {
+                    **cors_headers,
+                    "Content-Type": "application/x-ndjson"
+                },
+                "body": "".join(format_stream_frame(frame) for frame in frames)
+            }
+
         output_data = {}
 
-        if data.get("generate_flashcards"):
-            flashcards = quiz_generator.generate_flashcards()
+        quiz, flashcards = quiz_generator.generate_quiz_and_flashcards(
+            generate_quiz=int(data.get("num_questions", 0)) > 0,
+            generate_flashcards=bool(data.get("generate_flashcards"))
+        )
+
+        if flashcards is not None:
             output_data.update(flashcards.to_dict())
 
-        if int(data.get("num_questions", 0)) > 0:
-            quiz = quiz_generator.generate_quiz()
+        if quiz is not None:
             output_data.update(quiz.to_dict())
 
         quiz_context = quiz_generator.get_context()
@@ -93,4 +145,10 @@ def lambda_handler(event, context):
             "statusCode": 500,
             "headers": cors_headers,
             "body": json.dumps({"error": "InternalServerError", "message": str(e)})
-        }
\ No newline at end of file
+        }
+
+    finally:
+        # Removing decoded pdfs from Lambda /tmp storage
+        for pdf_path in pdf_paths:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
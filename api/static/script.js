@@ -112,7 +112,8 @@ document.addEventListener("DOMContentLoaded", function () {
                 formData.append("pdf_file", file);
             }            
             formData.append("data", new Blob([JSON.stringify(request_data)], { type: "application/json" }));
-            const response = await fetch("/generate-quiz", {
+            // Questions are streamed (json lines) and shown as soon as the first batch is generated
+            const response = await fetch("/generate-quiz?stream=ndjson", {
                 method: "POST",
                 // headers: { "Content-Type": "application/json" },                
                 body: formData,
@@ -130,20 +131,9 @@ document.addEventListener("DOMContentLoaded", function () {
                 return;
             }
 
-            const data = await response.json();
-            quizContext = data.quizContext;
-            if (!data.questionCards || !Array.isArray(data.questionCards)) {
-                throw new Error("Invalid response format");
-            }
-
-            questions = data.questionCards;
-            explanations = questions.map(q => q.answerExplanation);
+            questions = [];
             questionIndex = 0; // Reset index
-            loadQuestion(questionIndex);
-            // Show nav buttons when quiz is loaded
-            prevButton.style.display = "inline-block";
-            nextButton.style.display = "inline-block";
-            infoBtn.style.display = "flex";
+            await readFrames(response, handleFrame);
 
         } catch (error) {
             errorBox.innerHTML = `<p><strong>Unexpected Error</strong></p><p>${error.message}</p>`;
@@ -155,6 +145,53 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     }
 
+    async function readFrames(response, onFrame) {
+        // Splitting the streamed body into json lines, a line can be split over several reads
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+            const { done, value } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            let lines = buffer.split("\n");
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => onFrame(JSON.parse(line)));
+            if (done) {
+                if (buffer.trim()) {
+                    onFrame(JSON.parse(buffer));
+                }
+                return;
+            }
+        }
+    }
+
+    function handleFrame(frame) {
+        if (frame.event === "questions") {
+            questions = questions.concat(frame.questionCards);
+            explanations = questions.map(q => q.answerExplanation);
+            if (questions.length === frame.questionCards.length) {
+                // First batch: showing the quiz right away
+                document.getElementById("loader").style.visibility = "hidden";
+                loadQuestion(questionIndex);
+                prevButton.style.display = "inline-block";
+                nextButton.style.display = "inline-block";
+            } else {
+                updateCounter();
+            }
+        } else if (frame.event === "quizContext") {
+            quizContext = frame.quizContext;
+            infoBtn.style.display = "flex";
+        } else if (frame.event === "error") {
+            let stackTrace = frame.stack_trace ? `<pre>${frame.stack_trace}</pre>` : "";
+            errorBox.innerHTML = `
+                <p><strong>${frame.error}</strong></p>
+                <p>${frame.message}</p>
+                ${stackTrace}
+            `;
+            errorBox.style.display = "block";
+        }
+    }
+
     function updateCounter() {
         questionCounter.innerText = `${questionIndex + 1}/${questions.length}`;
     }
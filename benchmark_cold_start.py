@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark of the Lambda handler: measures import time per module with `python -X importtime`
+in fresh interpreters, for each request scenario (handler module only, then modules loaded per content source)
+
+Usage: python benchmark_cold_start.py [--runs 5] [--top 15]
+"""
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+# Modules imported by each scenario, on top of the handler module
+SCENARIOS = {
+    "handler (preflight)": ["api.lambda_function"],
+    "text content": ["api.lambda_function", "src.quiz_config", "src.raqam"],
+    "url": ["api.lambda_function", "src.quiz_config", "src.raqam", "src.web_page"],
+    "pdf file": ["api.lambda_function", "src.quiz_config", "src.raqam", "src.pdf"],
+    "local ranking": ["api.lambda_function", "src.quiz_config", "src.raqam", "src.ranking"],
+    "embeddings": ["api.lambda_function", "src.quiz_config", "src.raqam", "src.vector_store"]
+}
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def measure_imports(modules):
+    """
+    Imports modules in a fresh interpreter and returns the cumulative import time (in microseconds) of
+    every top-level import and of the modules they import directly ("parent > child")
+
+    @param modules: Names of modules to import
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    timings = {}
+    children = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)), (len(match.group(3)) - 1) // 2, match.group(4)
+        # Children are printed before their parent: direct children are kept until their parent shows up
+        if depth == 1:
+            children.append((name, cumulative))
+        elif depth == 0:
+            timings[name] = timings.get(name, 0) + cumulative
+            for child, child_cumulative in children:
+                timings[f"{name} > {child}"] = timings.get(f"{name} > {child}", 0) + child_cumulative
+            children = []
+    return timings
+
+def benchmark(runs,
+              top):
+    """
+    Prints the median total import time of each scenario and its most expensive top-level imports
+
+    @param runs: Number of fresh interpreters per scenario
+    @param top: Number of modules to print per scenario
+    """
+    for scenario, modules in SCENARIOS.items():
+        runs_timings = [measure_imports(modules) for _ in range(runs)]
+        module_names = set().union(*runs_timings)
+        medians = {name: statistics.median(timings.get(name, 0) for timings in runs_timings) for name in module_names}
+        total = statistics.median(sum(duration for name, duration in timings.items() if " > " not in name) for timings in runs_timings)
+        print(f"\n{scenario}: {total / 1000:.1f} ms (median of {runs} runs)")
+        for name, duration in sorted(medians.items(), key=lambda item: item[1], reverse=True)[:top]:
+            print(f"  {duration / 1000:8.1f} ms  {name}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start import time benchmark of the Lambda handler")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters per scenario")
+    parser.add_argument("--top", type=int, default=15, help="Number of modules printed per scenario")
+    args = parser.parse_args()
+    benchmark(runs=args.runs, top=args.top)
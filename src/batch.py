@@ -0,0 +1,139 @@
+"""
+Batch generation on several documents sharing embedding batches and one LLM concurrency budget
+"""
+import threading
+import traceback
+import concurrent.futures
+
+import numpy as np
+
+from src.exception import RAQAMException, InvalidInputDataException
+from src.raqam import QuizGenerator
+
+
+class BatchQuizGenerator():
+    def __init__(self,
+                 quiz_configs,
+                 max_concurrency=8):
+        """
+        Generates quizzes and flashcards on several documents at once. Documents are extracted in parallel,
+        chunks of all documents are embedded together (shared embedding batches) and all LLM calls are
+        scheduled under a single concurrency limit. A failing document does not fail the others.
+
+        @param quiz_configs: One parsed QuizConfig per document
+        @param max_concurrency: Maximum number of LLM calls in flight for the whole batch
+        """
+        self.quiz_configs = quiz_configs
+        self.llm_semaphore = threading.BoundedSemaphore(max(1, int(max_concurrency or 1)))
+        self.max_workers = max(1, min(len(quiz_configs), int(max_concurrency or 1)))
+        # Generators (None for documents that failed), embeddings of their chunks and errors per document
+        self.quiz_generators = [None] * len(quiz_configs)
+        self.chunk_embeddings = [None] * len(quiz_configs)
+        self.errors = [None] * len(quiz_configs)
+
+    def run_safely(self,
+                   index,
+                   function):
+        """
+        Calls function for the document at index, recording its error instead of raising it
+
+        @param index: Index of the document
+        @param function: Function to call
+        """
+        try:
+            return function()
+        except RAQAMException as e:
+            self.errors[index] = {"error": e.error, "message": e.message, "status_code": e.status_code}
+        except Exception as e:
+            print(f"Unexpected error on batch document {index}: {str(e)}\nStack Trace: {traceback.format_exc()}")
+            self.errors[index] = {"error": "InternalServerError", "message": str(e), "status_code": 500}
+
+    def build_generators(self):
+        """
+        Extracts and chunks every document in parallel, without embedding chunks yet
+        """
+        def build(index):
+            self.quiz_generators[index] = QuizGenerator(**self.quiz_configs[index].__dict__,
+                                                        llm_semaphore=self.llm_semaphore,
+                                                        prepare_retrieval=False)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(lambda index: self.run_safely(index, lambda: build(index)), range(len(self.quiz_configs))))
+
+    def embed_shared_chunks(self):
+        """
+        Embeds the chunks of all documents that need embeddings in shared batches, grouped by embedding
+        model, dimensions and embedding cache. Each document then receives the embeddings of its chunks, and the tokens
+        of every embedded chunk (cache misses only) are split evenly between the documents containing it.
+        """
+        from src.vector_store import VectorStore
+        groups = {}
+        for index, quiz_generator in enumerate(self.quiz_generators):
+            if quiz_generator is not None and quiz_generator.needs_embeddings:
+                groups.setdefault((quiz_generator.embedding_model_key, id(quiz_generator.embedding_cache)), []).append(index)
+        for indices in groups.values():
+            quiz_generators = [self.quiz_generators[index] for index in indices]
+            # Packing unique chunks of every document into the same batches
+            chunk_positions, chunk_token_counts = {}, []
+            for quiz_generator in quiz_generators:
+                token_counts = quiz_generator.text_document.chunk_token_counts
+                for i, chunk in enumerate(quiz_generator.text_document.text_chunks):
+                    if chunk not in chunk_positions:
+                        chunk_positions[chunk] = len(chunk_positions)
+                        chunk_token_counts.append(token_counts[i] if token_counts is not None else None)
+            chunks = list(chunk_positions)
+            vector_store = VectorStore(embedding_model=quiz_generators[0].embedding_model,
+                                       embedding_batch_size=quiz_generators[0].embedding_batch_size,
+                                       embedding_cache=quiz_generators[0].embedding_cache)
+            embeddings, chunk_tokens = vector_store.generate_embeddings(chunks=chunks,
+                                                                        chunk_token_counts=chunk_token_counts if None not in chunk_token_counts else None,
+                                                                        per_chunk_tokens=True)
+            # Number of documents sharing every chunk
+            chunk_documents = np.zeros(len(chunks))
+            document_positions = []
+            for quiz_generator in quiz_generators:
+                positions = np.array([chunk_positions[chunk] for chunk in quiz_generator.text_document.text_chunks], dtype=np.int64)
+                document_positions.append(positions)
+                chunk_documents[np.unique(positions)] += 1
+            for index, quiz_generator, positions in zip(indices, quiz_generators, document_positions):
+                self.chunk_embeddings[index] = embeddings[positions]
+                unique_positions = np.unique(positions)
+                quiz_generator.usage.add_embedding_usage(tokens=round(float((chunk_tokens[unique_positions] / chunk_documents[unique_positions]).sum())))
+
+    def generate(self):
+        """
+        Runs the batch and returns one output per document, in order: the generated flashcards, quiz and
+        quizContext, or an error
+        """
+        self.build_generators()
+        self.embed_shared_chunks()
+        def generate_document(index):
+            quiz_generator = self.quiz_generators[index]
+            quiz_generator.prepare_retrieval(chunk_embeddings=self.chunk_embeddings[index])
+            quiz, flashcards = quiz_generator.generate_quiz_and_flashcards(generate_quiz=quiz_generator.num_questions > 0,
+                                                                           generate_flashcards=quiz_generator.flashcards_requested)
+            return quiz_generator.build_output_data(quiz=quiz, flashcards=flashcards)
+        indices = [index for index, quiz_generator in enumerate(self.quiz_generators) if quiz_generator is not None]
+        outputs = [None] * len(self.quiz_configs)
+        # Documents are generated at the same time, their LLM calls share the batch semaphore
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for index, output_data in zip(indices, executor.map(lambda index: self.run_safely(index, lambda: generate_document(index)), indices)):
+                outputs[index] = output_data
+        return [output_data if self.errors[index] is None else {"error": self.errors[index]} for index, output_data in enumerate(outputs)]
+
+
+def parse_batch_documents(data,
+                          max_documents=20):
+    """
+    Splits a batch request into one request data per document: each document (data source arguments)
+    inherits the batch settings (num_questions, num_choices, ...), which it can override
+
+    @param data: Batch request data ({"documents": [...], settings})
+    @param max_documents: Maximum number of documents of a batch
+    """
+    documents = data.get("documents")
+    if not isinstance(documents, list) or not documents:
+        raise InvalidInputDataException(message="Must provide a non-empty list of documents")
+    if len(documents) > max_documents:
+        raise InvalidInputDataException(message=f"A batch can contain at most {max_documents} documents")
+    settings = {key: value for key, value in data.items() if key != "documents"}
+    return [{**settings, **document} for document in documents]
@@ -0,0 +1,401 @@
+import os
+import json
+import time
+import struct
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+# File written in every persisted vector store (see VectorStore.save_vector_store): only directories
+# holding it are tracked and evicted by the disk budget
+VECTOR_STORE_MARKER = "index.json"
+# Fraction of the disk budget kept after an eviction (evicting below the limit spaces out evictions)
+EVICTION_TARGET = 0.9
+
+
+def hash_key(*parts):
+    """
+    Builds a content-addressed cache key (sha256 hex digest) from json serializable parts
+
+    @param parts: Values identifying the cached content
+    """
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def normalize_text(text):
+    """
+    Normalizes text content before hashing so that whitespace-only differences share the same key
+
+    @param text: Text to normalize
+    """
+    return " ".join(text.split())
+
+
+class DiskBudget():
+    def __init__(self,
+                 max_size_mb=None):
+        """
+        Disk size budget shared by disk caches and persisted vector stores. Entries (files or directories)
+        are tracked in memory with their size in least recently used order, so that writes never scan
+        directories: directories are only rescanned (to account for other processes) and least recently
+        used entries evicted when the tracked total exceeds the budget.
+
+        @param max_size_mb: Maximum total size of entries in MB (None for no limit)
+        """
+        self.max_size = max_size_mb * 1024 * 1024 if max_size_mb else None
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.directories = []
+        self.lock = threading.Lock()
+
+    def _scan_directory(self,
+                        directory,
+                        entry_type):
+        """
+        Returns (modification time, size, path) of the entries of a directory
+
+        @param directory: Directory to scan
+        @param entry_type: "file" (cache files) or "directory" (vector stores holding VECTOR_STORE_MARKER)
+        """
+        entries = []
+        try:
+            for entry in os.scandir(directory):
+                if entry_type == "file" and entry.is_file() and entry.name.endswith(".bin"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                elif (entry_type == "directory" and entry.is_dir() and not entry.name.endswith(".tmp")
+                      and os.path.isfile(os.path.join(entry.path, VECTOR_STORE_MARKER))):
+                    # Only vector stores written by the registry (other directories are never evicted)
+                    size = sum(file.stat().st_size for file in os.scandir(entry.path) if file.is_file())
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+        except OSError:
+            pass
+        return entries
+
+    def add_directory(self,
+                      directory,
+                      entry_type="file"):
+        """
+        Registers a directory whose entries count towards the budget (scanned once here)
+
+        @param directory: Directory of entries
+        @param entry_type: "file" (cache files) or "directory" (vector stores)
+        """
+        with self.lock:
+            self.directories.append((directory, entry_type))
+            for _, size, path in sorted(self._scan_directory(directory, entry_type)):
+                self._track(path, size)
+        self.evict()
+
+    def _track(self,
+               path,
+               size):
+        self.total_size += size - self.entries.pop(path, 0)
+        self.entries[path] = size
+
+    def track(self,
+              path,
+              size):
+        """
+        Records a written (or rewritten) entry as most recently used, then evicts entries if over budget
+
+        @param path: Path of the entry
+        @param size: Size of the entry in bytes
+        """
+        with self.lock:
+            self._track(path, size)
+        self.evict()
+
+    def touch(self,
+              path):
+        """
+        Marks an entry as most recently used
+
+        @param path: Path of the entry
+        """
+        with self.lock:
+            if path in self.entries:
+                self.entries.move_to_end(path)
+
+    def forget(self,
+               path):
+        """
+        Stops tracking a removed entry
+
+        @param path: Path of the entry
+        """
+        with self.lock:
+            self.total_size -= self.entries.pop(path, 0)
+
+    def evict(self):
+        """
+        Removes least recently used entries down to EVICTION_TARGET of the budget, if the budget is exceeded
+        """
+        with self.lock:
+            if not self.max_size or self.total_size <= self.max_size:
+                return
+            # Resynchronizing with the disk (entries written or removed by other processes, ordered by usage time)
+            entries = sorted(entry for directory, entry_type in self.directories
+                             for entry in self._scan_directory(directory, entry_type))
+            self.entries, self.total_size = OrderedDict(), 0
+            for _, size, path in entries:
+                self._track(path, size)
+            while self.entries and self.total_size > self.max_size * EVICTION_TARGET:
+                path, size = self.entries.popitem(last=False)
+                self.total_size -= size
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+class TieredCache():
+    def __init__(self,
+                 max_entries=128,
+                 cache_dir=None,
+                 max_disk_size_mb=None,
+                 ttl_seconds=None,
+                 disk_budget=None,
+                 max_memory_size_mb=None):
+        """
+        Key/value cache (bytes values) with an in-memory LRU tier and an optional size-bounded disk tier.
+
+        @param max_entries: Maximum number of entries to keep in memory
+        @param cache_dir: Directory of the disk tier (None to disable it)
+        @param max_disk_size_mb: Maximum size of the disk tier in MB, least recently used files are evicted first (without disk_budget)
+        @param ttl_seconds: Time to live of an entry in seconds (None for no expiration)
+        @param disk_budget: DiskBudget shared with other disk caches (overrides max_disk_size_mb)
+        @param max_memory_size_mb: Maximum size of the values kept in memory in MB (None for no limit)
+        """
+        self.max_entries = max_entries
+        self.max_memory_size = max_memory_size_mb * 1024 * 1024 if max_memory_size_mb else None
+        self.memory_size = 0
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk_budget = None
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.disk_budget = disk_budget or DiskBudget(max_size_mb=max_disk_size_mb)
+            self.disk_budget.add_directory(self.cache_dir, entry_type="file")
+
+    def _disk_path(self,
+                   key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _is_expired(self,
+                    created_at):
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _set_memory(self,
+                    key,
+                    value,
+                    created_at):
+        with self.lock:
+            if key in self.memory:
+                self.memory_size -= len(self.memory.pop(key)[1])
+            self.memory[key] = (created_at, value)
+            self.memory_size += len(value)
+            while len(self.memory) > self.max_entries or (self.max_memory_size and self.memory_size > self.max_memory_size):
+                self.memory_size -= len(self.memory.popitem(last=False)[1][1])
+
+    def get(self,
+            key):
+        """
+        Returns the cached value for key or None on a miss
+
+        @param key: Cache key
+        """
+        with self.lock:
+            if key in self.memory:
+                created_at, value = self.memory[key]
+                if not self._is_expired(created_at):
+                    self.memory.move_to_end(key)
+                    return value
+                self.memory_size -= len(self.memory.pop(key)[1])
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as file:
+                # Disk entries start with their creation timestamp (used for expiration)
+                created_at, = struct.unpack("<d", file.read(8))
+                value = file.read()
+            if self._is_expired(created_at):
+                os.remove(path)
+                self.disk_budget.forget(path)
+                return None
+            # Refreshing modification time so that disk eviction follows recent usage (also across processes)
+            os.utime(path)
+            self.disk_budget.touch(path)
+        except (OSError, struct.error):
+            return None
+        self._set_memory(key, value, created_at)
+        return value
+
+    def set(self,
+            key,
+            value):
+        """
+        Stores a value in memory and, if enabled, on disk
+
+        @param key: Cache key
+        @param value: Bytes value to store
+        """
+        created_at = time.time()
+        self._set_memory(key, value, created_at)
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            # Writing to a temporary file first so that concurrent readers never see a partial file
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(struct.pack("<d", created_at))
+                file.write(value)
+            os.replace(tmp_path, path)
+            self.disk_budget.track(path, 8 + len(value))
+        except OSError:
+            pass
+
+    def get_json(self,
+                 key):
+        """
+        Returns the cached json value for key or None on a miss
+
+        @param key: Cache key
+        """
+        value = self.get(key)
+        return json.loads(value.decode("utf-8")) if value is not None else None
+
+    def set_json(self,
+                 key,
+                 value):
+        """
+        Stores a json serializable value
+
+        @param key: Cache key
+        @param value: Json serializable value
+        """
+        self.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+# Process-wide caches, shared by all requests handled by the same worker / warm Lambda container
+_caches = {}
+_caches_lock = threading.Lock()
+_disk_budget = None
+
+def get_disk_budget(max_size_mb=None):
+    """
+    Returns the process-wide disk budget shared by disk caches and the vector store registry, creating
+    it on first use
+
+    @param max_size_mb: Maximum total disk size in MB (used on creation)
+    """
+    global _disk_budget
+    with _caches_lock:
+        if _disk_budget is None:
+            _disk_budget = DiskBudget(max_size_mb=max_size_mb)
+        return _disk_budget
+
+def get_cache(name,
+              max_entries=128,
+              cache_dir=None,
+              max_disk_size_mb=None,
+              ttl_seconds=None,
+              max_memory_size_mb=None):
+    """
+    Returns the process-wide cache registered under name, creating it on first use
+
+    @param name: Name of the cache (also used as sub-directory of cache_dir)
+    @param max_entries: Maximum number of entries to keep in memory
+    @param cache_dir: Root directory of disk caches (None for memory only)
+    @param max_disk_size_mb: Maximum total size of disk caches in MB (process-wide disk budget shared by all caches)
+    @param ttl_seconds: Time to live of an entry in seconds (None for no expiration)
+    @param max_memory_size_mb: Maximum size of the values kept in memory in MB (None for no limit)
+    """
+    disk_budget = get_disk_budget(max_size_mb=max_disk_size_mb) if cache_dir else None
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TieredCache(max_entries=max_entries,
+                                        cache_dir=os.path.join(cache_dir, name) if cache_dir else None,
+                                        ttl_seconds=ttl_seconds,
+                                        disk_budget=disk_budget,
+                                        max_memory_size_mb=max_memory_size_mb)
+        return _caches[name]
+
+
+class VectorStoreRegistry():
+    def __init__(self,
+                 root_dir,
+                 max_size_mb=None,
+                 disk_budget=None):
+        """
+        Registry of persisted vector stores keyed by document fingerprint and embedding model. Each store
+        lives in its own sub-directory and least recently used stores are removed when the disk budget
+        is exceeded (only stores written by the registry, other directories of root_dir are left alone).
+
+        @param root_dir: Directory where vector stores are persisted
+        @param max_size_mb: Maximum total size of persisted vector stores in MB (without disk_budget, None for no limit)
+        @param disk_budget: DiskBudget shared with disk caches (overrides max_size_mb)
+        """
+        self.root_dir = root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+        self.disk_budget = disk_budget or DiskBudget(max_size_mb=max_size_mb)
+        self.disk_budget.add_directory(self.root_dir, entry_type="directory")
+
+    def get_path(self,
+                 fingerprint,
+                 embedding_model_name):
+        """
+        Returns the directory of the vector store for a document fingerprint and an embedding model
+
+        @param fingerprint: Fingerprint (hash) of the document chunks
+        @param embedding_model_name: Name of the embedding model used for the vector store
+        """
+        safe_model_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in embedding_model_name)
+        return os.path.join(self.root_dir, f"{safe_model_name}-{fingerprint}")
+
+    def exists(self,
+               path):
+        """
+        Checks if a vector store is persisted at path and marks it as recently used
+
+        @param path: Vector store directory returned by get_path
+        """
+        if not os.path.isdir(path):
+            return False
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.disk_budget.touch(path)
+        return True
+
+    def save(self,
+             path,
+             save_function):
+        """
+        Persists a vector store atomically then evicts least recently used stores if needed
+
+        @param path: Vector store directory returned by get_path
+        @param save_function: Function saving the vector store into the directory given as argument
+        """
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            save_function(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another request may have persisted the same store in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        try:
+            size = sum(file.stat().st_size for file in os.scandir(path) if file.is_file())
+        except OSError:
+            return
+        self.disk_budget.track(path, size)
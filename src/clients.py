@@ -0,0 +1,55 @@
+"""
+Process-wide registry of LLM and embedding clients sharing pooled keep-alive HTTP connections
+"""
+import threading
+
+import httpx
+from openai import DefaultHttpxClient
+
+# Clients are shared by all requests handled by the same worker / warm Lambda container
+_clients = {}
+_http_clients = {}
+_clients_lock = threading.Lock()
+
+def get_http_client(max_connections=32,
+                    keepalive_seconds=60):
+    """
+    Returns the process-wide pooled HTTP client for these pool settings, creating it on first use.
+    Connections are kept alive between requests so that TLS handshakes are only paid once per connection.
+
+    @param max_connections: Maximum number of connections of the pool (should exceed LLM max_concurrency)
+    @param keepalive_seconds: Number of seconds an idle connection is kept open
+    """
+    key = (max_connections, keepalive_seconds)
+    with _clients_lock:
+        if key not in _http_clients:
+            # OpenAI defaults (timeouts, redirects) with a larger keep-alive pool
+            _http_clients[key] = DefaultHttpxClient(limits=httpx.Limits(max_connections=max_connections,
+                                                                    max_keepalive_connections=max_connections,
+                                                                    keepalive_expiry=keepalive_seconds))
+        return _http_clients[key]
+
+def get_client(client_class,
+               model,
+               max_connections=32,
+               keepalive_seconds=60,
+               **settings):
+    """
+    Returns the process-wide langchain client of client_class for a model and settings, creating it on
+    first use. Clients hold no request state (structured output wrappers and usage are built per request).
+
+    @param client_class: Langchain client class (ex: ChatOpenAI, OpenAIEmbeddings)
+    @param model: Name of the model
+    @param max_connections: Maximum number of connections of the shared HTTP pool
+    @param keepalive_seconds: Number of seconds an idle connection is kept open
+    @param settings: Other keyword arguments of the client (part of the registry key)
+    """
+    key = (client_class.__name__, model, max_connections, keepalive_seconds, tuple(sorted(settings.items())))
+    with _clients_lock:
+        if key in _clients:
+            return _clients[key]
+    http_client = get_http_client(max_connections=max_connections, keepalive_seconds=keepalive_seconds)
+    client = client_class(model=model, http_client=http_client, **settings)
+    with _clients_lock:
+        # Keeping the first registered client if another request created one in the meantime
+        return _clients.setdefault(key, client)
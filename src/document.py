@@ -1,34 +1,71 @@
+import hashlib
 import traceback
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from functools import reduce
-
 from src.exception import DocumentParsingException
+from src.model_catalog import get_encoding
+from src.cache import normalize_text
+
+# Number of chunks of text buffered before splitting when parts are merged (bounds memory on large documents)
+MERGE_BUFFER_CHUNKS = 16
 
 class Document():
     def __init__(self,
-                 text_data: list[str],
+                 text_data,
                  chunk_size: int=500,
-                 chunk_overlap: int=50):
+                 chunk_overlap: int=50,
+                 chunking_mode: str="characters",
+                 encoding_model_name: str=None,
+                 merge_parts: bool=False):
         """
         A document that is defined by its text content. Input data may be a list of texts in the
-        case where a pre-split can be performed on original text.
+        case where a pre-split can be performed on original text, or any iterable of texts (ex: a
+        generator of pdf pages) which is then consumed once in a streaming way.
 
-        @param text_data: List of texts to feed as input for text document
+        @param text_data: List (or iterable) of texts to feed as input for text document
+        @param chunk_size: Size of chunks (in characters or in tokens depending on chunking_mode)
+        @param chunk_overlap: Overlap between chunks (in characters or in tokens depending on chunking_mode)
+        @param chunking_mode: "characters" to split by characters, "tokens" to split by tokens
+        @param encoding_model_name: Model whose tokenizer is used in "tokens" chunking mode
+        @param merge_parts: Whether parts are consecutive pieces of one text (chunks may then span several parts)
         """
-        # Defining class attributes
-        self.text_data = text_data
+        # Defining class attributes (streamed text data is not retained)
+        self.text_data = text_data if isinstance(text_data, list) else None
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.content_length = sum([len(text) for text in text_data])
+        self.chunking_mode = chunking_mode
+        self.encoding_model_name = encoding_model_name
+        self.merge_parts = merge_parts
+        # Content length and fingerprint are computed while text data is consumed
+        self.content_length = 0
+        self.content_hasher = hashlib.sha256()
+        # Number of tokens of each chunk (only known in "tokens" chunking mode)
+        self.chunk_token_counts = None
         # Defining text splitter to use
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
         # Splitting input text data into chunks of text
         try:
-            self.text_chunks = self.split_text_data_into_chunks(text_data=text_data)
+            if self.chunking_mode == "tokens":
+                self.text_chunks, self.chunk_token_counts = self.split_text_data_into_token_chunks(text_data=text_data)
+            else:
+                self.text_chunks = self.split_text_data_into_chunks(text_data=text_data)
         except Exception as e:
             raise DocumentParsingException(stack_trace=traceback.format_exc())
+        self.content_hash = self.content_hasher.hexdigest()
+
+    def consume_text_data(self,
+                          text_data):
+        """
+        Yields texts of text data while updating content length and content fingerprint (whitespace
+        normalized sha256)
+
+        @param text_data: Iterable of texts
+        """
+        for text in text_data:
+            self.content_length += len(text)
+            self.content_hasher.update(normalize_text(text).encode("utf-8") + b"\0")
+            yield text
 
     def split_text_into_chunks(self,
                                text):
@@ -40,12 +77,120 @@ class Document():
         """
         return self.text_splitter.split_text(text)
 
+    def iter_text_chunks(self,
+                         text_data):
+        """
+        Yields chunks of text from text data. If parts are merged, consecutive parts are buffered up to
+        MERGE_BUFFER_CHUNKS chunks and the last (incomplete) chunk of the buffer is carried over to the
+        next part, so chunks span parts without ever joining the whole text.
+
+        @param text_data: Iterable of texts to split
+        """
+        if not self.merge_parts:
+            for text in self.consume_text_data(text_data):
+                yield from self.split_text_into_chunks(text)
+            return
+        buffer = ""
+        for text in self.consume_text_data(text_data):
+            buffer = f"{buffer}\n\n{text}" if buffer else text
+            if len(buffer) >= MERGE_BUFFER_CHUNKS * self.chunk_size:
+                chunks = self.split_text_into_chunks(buffer)
+                yield from chunks[:-1]
+                buffer = chunks[-1] if chunks else ""
+        if buffer:
+            yield from self.split_text_into_chunks(buffer)
+
     def split_text_data_into_chunks(self,
                                     text_data):
         """
         Splits text data into chunks of text. If text data is initially splitted (len(text_data) > 0) then
         splits the text for each original part.
 
-        @param text_data: List of texts to split  
+        @param text_data: List (or iterable) of texts to split  
+        """
+        return list(self.iter_text_chunks(text_data))
+
+    def get_window_starts(self,
+                          nb_tokens,
+                          complete_only=False):
+        """
+        Returns start positions of token windows of chunk_size tokens with an overlap of chunk_overlap tokens
+
+        @param nb_tokens: Number of tokens to split
+        @param complete_only: Whether to only keep windows of exactly chunk_size tokens
+        """
+        step = max(1, self.chunk_size - self.chunk_overlap)
+        if complete_only:
+            return list(range(0, nb_tokens - self.chunk_size + 1, step))
+        return list(range(0, max(1, nb_tokens - self.chunk_overlap), step))
+
+    def decode_windows(self,
+                       encoding,
+                       tokens,
+                       starts):
+        """
+        Yields (chunk, number of tokens) pairs decoded from the token windows starting at starts
+
+        @param encoding: Tiktoken encoding
+        @param tokens: List of tokens
+        @param starts: Start positions of windows
+        """
+        for start in starts:
+            window = tokens[start:start + self.chunk_size]
+            yield encoding.decode(window).strip(), len(window)
+
+    def iter_token_chunks(self,
+                          text_data):
+        """
+        Yields (chunk, number of tokens) pairs of chunk_size tokens with an overlap of chunk_overlap tokens.
+        Lists of texts are encoded once (batch encoding), streamed texts are encoded part by part. Chunks
+        are decoded from token windows, so the number of tokens of every chunk is known without tokenizing again.
+
+        @param text_data: List (or iterable) of texts to split
+        """
+        encoding = get_encoding(self.encoding_model_name)
+        if isinstance(text_data, list) and not self.merge_parts:
+            encoded_parts = encoding.encode_ordinary_batch(list(self.consume_text_data(text_data)))
+        else:
+            encoded_parts = (encoding.encode_ordinary(text) for text in self.consume_text_data(text_data))
+        separator = encoding.encode_ordinary("\n\n")
+        step = max(1, self.chunk_size - self.chunk_overlap)
+        buffer = []
+        for tokens in encoded_parts:
+            if not self.merge_parts:
+                yield from self.decode_windows(encoding, tokens, self.get_window_starts(len(tokens)))
+                continue
+            buffer = buffer + separator + tokens if buffer else tokens
+            if len(buffer) >= MERGE_BUFFER_CHUNKS * self.chunk_size:
+                # Yielding complete windows only and carrying remaining tokens over to next part
+                starts = self.get_window_starts(len(buffer), complete_only=True)
+                yield from self.decode_windows(encoding, buffer, starts)
+                buffer = buffer[len(starts) * step:]
+        if buffer:
+            yield from self.decode_windows(encoding, buffer, self.get_window_starts(len(buffer)))
+
+    def split_text_data_into_token_chunks(self,
+                                          text_data):
+        """
+        Splits text data into chunks of chunk_size tokens with an overlap of chunk_overlap tokens.
+        Returns the list of chunks and the list of their token counts.
+
+        @param text_data: List (or iterable) of texts to split
+        """
+        text_chunks, chunk_token_counts = [], []
+        for chunk, token_count in self.iter_token_chunks(text_data):
+            if chunk:
+                text_chunks.append(chunk)
+                chunk_token_counts.append(token_count)
+        return text_chunks, chunk_token_counts
+
+    def keep_chunks(self,
+                    indices):
+        """
+        Keeps only the chunks at indices (used to sample chunks of large documents)
+
+        @param indices: Indices of chunks to keep
         """
-        return reduce(lambda x,y: x+y, [self.split_text_into_chunks(text) for text in text_data])
+        self.text_chunks = [self.text_chunks[i] for i in indices]
+        if self.chunk_token_counts is not None:
+            self.chunk_token_counts = [self.chunk_token_counts[i] for i in indices]
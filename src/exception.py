@@ -44,3 +44,15 @@ class WebPageException(RAQAMException):
         super().__init__(error="WebPageException", 
                          status_code=403,
                          message=message)         
+
+class JobNotFoundException(RAQAMException):
+    def __init__(self, job_id):
+        super().__init__(error="JobNotFoundException", 
+                         status_code=404,
+                         message=f"No job found with id {job_id}")
+
+class JobQueueFullException(RAQAMException):
+    def __init__(self):
+        super().__init__(error="JobQueueFullException", 
+                         status_code=503,
+                         message="Too many pending jobs, retry later")
@@ -0,0 +1,227 @@
+"""
+Asynchronous generation jobs: pluggable job stores (in-memory or SQLite) and a bounded worker pool
+"""
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+import concurrent.futures
+from collections import OrderedDict
+
+from src.exception import RAQAMException, JobNotFoundException, JobQueueFullException
+
+
+class InMemoryJobStore():
+    def __init__(self,
+                 max_jobs=1000,
+                 ttl_seconds=None):
+        """
+        Job store kept in process memory (jobs are lost on restart and not shared between processes)
+
+        @param max_jobs: Maximum number of jobs kept, oldest jobs are removed first
+        @param ttl_seconds: Time to live of a job in seconds (None for no expiration)
+        """
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self,
+               job_id):
+        """
+        Registers a new queued job
+
+        @param job_id: Id of the job
+        """
+        now = time.time()
+        with self.lock:
+            self.jobs[job_id] = {"id": job_id, "status": "queued", "stage": None, "progress": None,
+                                 "result": None, "error": None, "created_at": now, "updated_at": now}
+            while len(self.jobs) > self.max_jobs or (self.ttl_seconds and now - next(iter(self.jobs.values()))["created_at"] > self.ttl_seconds):
+                self.jobs.popitem(last=False)
+
+    def update(self,
+               job_id,
+               **fields):
+        """
+        Updates fields of a job (status, stage, progress, result or error)
+
+        @param job_id: Id of the job
+        @param fields: Fields to update
+        """
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields, updated_at=time.time())
+
+    def get(self,
+            job_id):
+        """
+        Returns a copy of a job or None if it does not exist
+
+        @param job_id: Id of the job
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+
+class SQLiteJobStore():
+    def __init__(self,
+                 path,
+                 ttl_seconds=None):
+        """
+        Job store persisted in a SQLite database (survives restarts and is shared by local processes)
+
+        @param path: Path of the SQLite database file
+        @param ttl_seconds: Time to live of a job in seconds (None for no expiration)
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        with self.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, stage TEXT, progress TEXT, "
+                               "result TEXT, error TEXT, created_at REAL, updated_at REAL)")
+
+    def connect(self):
+        # One connection per call: connections cannot be shared between worker threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self,
+               job_id):
+        """
+        Registers a new queued job
+
+        @param job_id: Id of the job
+        """
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("INSERT INTO jobs (id, status, created_at, updated_at) VALUES (?, 'queued', ?, ?)", (job_id, now, now))
+            if self.ttl_seconds:
+                connection.execute("DELETE FROM jobs WHERE created_at < ?", (now - self.ttl_seconds,))
+
+    def update(self,
+               job_id,
+               **fields):
+        """
+        Updates fields of a job (status, stage, progress, result or error)
+
+        @param job_id: Id of the job
+        @param fields: Fields to update
+        """
+        # Structured fields are stored as json
+        values = {key: json.dumps(value) if key in ["progress", "result", "error"] else value for key, value in fields.items()}
+        values["updated_at"] = time.time()
+        with self.connect() as connection:
+            connection.execute(f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in values)} WHERE id = ?",
+                               (*values.values(), job_id))
+
+    def get(self,
+            job_id):
+        """
+        Returns a job or None if it does not exist
+
+        @param job_id: Id of the job
+        """
+        with self.connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ["progress", "result", "error"]:
+            job[key] = json.loads(job[key]) if job[key] is not None else None
+        return job
+
+
+def create_job_store(store_type="memory",
+                     path=None,
+                     ttl_hours=None):
+    """
+    Creates the job store configured for the API
+
+    @param store_type: "memory" or "sqlite"
+    @param path: Path of the SQLite database (sqlite store only)
+    @param ttl_hours: Time to live of jobs in hours (None for no expiration)
+    """
+    ttl_seconds = ttl_hours * 3600 if ttl_hours else None
+    if store_type == "sqlite":
+        return SQLiteJobStore(path=path, ttl_seconds=ttl_seconds)
+    return InMemoryJobStore(ttl_seconds=ttl_seconds)
+
+
+class JobRunner():
+    def __init__(self,
+                 store,
+                 max_workers=2,
+                 max_pending_jobs=32):
+        """
+        Runs jobs on a bounded pool of worker threads and records their status, progress and result in a job store
+
+        @param store: Job store (InMemoryJobStore or SQLiteJobStore)
+        @param max_workers: Number of jobs running at the same time
+        @param max_pending_jobs: Maximum number of queued and running jobs, new jobs are rejected beyond
+        """
+        self.store = store
+        self.max_pending_jobs = max_pending_jobs
+        self.pending_jobs = 0
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self,
+               function,
+               **kwargs):
+        """
+        Queues a job and returns its id. The function is called with kwargs and a report_progress(stage, completed, total)
+        callback, its return value (json serializable) is stored as the job result.
+
+        @param function: Function running the job
+        @param kwargs: Keyword arguments of the function
+        """
+        with self.lock:
+            if self.pending_jobs >= self.max_pending_jobs:
+                raise JobQueueFullException()
+            self.pending_jobs += 1
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id)
+        self.executor.submit(self.run, job_id, function, kwargs)
+        return job_id
+
+    def run(self,
+            job_id,
+            function,
+            kwargs):
+        """
+        Runs a job in a worker thread
+
+        @param job_id: Id of the job
+        @param function: Function running the job
+        @param kwargs: Keyword arguments of the function
+        """
+        def report_progress(stage, completed=None, total=None):
+            progress = {"completed": completed, "total": total} if total is not None else None
+            self.store.update(job_id, stage=stage, progress=progress)
+        try:
+            self.store.update(job_id, status="running")
+            result = function(report_progress=report_progress, **kwargs)
+            self.store.update(job_id, status="succeeded", result=result)
+        except RAQAMException as e:
+            self.store.update(job_id, status="failed", error={"error": e.error, "message": e.message, "status_code": e.status_code})
+        except Exception as e:
+            print(f"Unexpected error in job {job_id}: {str(e)}\nStack Trace: {traceback.format_exc()}")
+            self.store.update(job_id, status="failed", error={"error": "InternalServerError", "message": str(e), "status_code": 500})
+        finally:
+            with self.lock:
+                self.pending_jobs -= 1
+
+    def get(self,
+            job_id):
+        """
+        Returns a job (status, stage, progress, result, error)
+
+        @param job_id: Id of the job
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            raise JobNotFoundException(job_id=job_id)
+        return job
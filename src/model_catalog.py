@@ -0,0 +1,109 @@
+"""
+Catalog of known generation and embedding models (prices, embedding dimensions and tokenizers)
+"""
+from functools import lru_cache
+
+# Prices are in $ per 1M tokens
+MODEL_CATALOG = {
+    # Generation models
+    "gpt-4o-mini": {"input": 0.075, "output": 0.600, "encoding": "o200k_base"},
+    "gpt-4o": {"input": 2.50, "output": 10.00, "encoding": "o200k_base"},
+    "gpt-4.1-nano": {"input": 0.10, "output": 0.40, "encoding": "o200k_base"},
+    "gpt-4.1-mini": {"input": 0.40, "output": 1.60, "encoding": "o200k_base"},
+    "gpt-4.1": {"input": 2.00, "output": 8.00, "encoding": "o200k_base"},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00, "encoding": "cl100k_base"},
+    "gpt-3.5-turbo": {"input": 0.50, "output": 1.50, "encoding": "cl100k_base"},
+    # Embedding models
+    "text-embedding-3-small": {"input": 0.020, "output": 0.0, "encoding": "cl100k_base", "dimension": 1536},
+    "text-embedding-3-large": {"input": 0.130, "output": 0.0, "encoding": "cl100k_base", "dimension": 3072},
+    "text-embedding-ada-002": {"input": 0.100, "output": 0.0, "encoding": "cl100k_base", "dimension": 1536}
+}
+
+# Used for models missing from the catalog: unknown prices and most recent OpenAI tokenizer
+DEFAULT_MODEL_INFO = {"input": None, "output": None, "encoding": "o200k_base"}
+
+def get_model_info(model_name):
+    """
+    Returns catalog information of a model. Dated or suffixed versions (ex: gpt-4o-mini-2024-07-18)
+    are matched to the longest known model name prefix.
+
+    @param model_name: Name of the model
+    """
+    if model_name in MODEL_CATALOG:
+        return MODEL_CATALOG[model_name]
+    matches = [name for name in MODEL_CATALOG if model_name.startswith(name)]
+    if matches:
+        return MODEL_CATALOG[max(matches, key=len)]
+    return DEFAULT_MODEL_INFO
+
+def get_embedding_dimension(embedding_model):
+    """
+    Returns the dimension of vectors generated by an embedding model without calling it, or None
+    if the model is unknown.
+
+    @param embedding_model: Langchain embeddings model
+    """
+    dimensions = getattr(embedding_model, "dimensions", None)
+    if dimensions:
+        return dimensions
+    return get_model_info(embedding_model.model).get("dimension")
+
+def get_embedding_model_key(embedding_model):
+    """
+    Returns the name identifying the vectors of an embedding model in caches: the model name, followed by
+    the requested number of dimensions when vectors are shortened (same model, different vectors).
+
+    @param embedding_model: Langchain embeddings model
+    """
+    dimensions = getattr(embedding_model, "dimensions", None)
+    return f"{embedding_model.model}-{dimensions}d" if dimensions else embedding_model.model
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    """
+    Returns the (cached) tiktoken encoding of a model
+
+    @param model_name: Name of the model
+    """
+    # tiktoken is imported on first use (it is not needed by requests that never count tokens)
+    import tiktoken
+    return tiktoken.get_encoding(get_model_info(model_name)["encoding"])
+
+def get_cost(model_name,
+             input_tokens=0,
+             output_tokens=0):
+    """
+    Returns the cost in $ of a number of input and output tokens for a model, or None if tokens were
+    used with a model whose prices are unknown (not in the catalog)
+
+    @param model_name: Name of the model
+    @param input_tokens: Number of input tokens
+    @param output_tokens: Number of output tokens
+    """
+    model_info = get_model_info(model_name)
+    cost = 0.0
+    for tokens, price in [(input_tokens, model_info["input"]), (output_tokens, model_info["output"])]:
+        if not tokens:
+            continue
+        if price is None:
+            warn_unknown_price(model_name)
+            return None
+        cost += (tokens / 1e6) * price
+    return cost
+
+@lru_cache(maxsize=None)
+def warn_unknown_price(model_name):
+    """
+    Logs (once per model) that costs of a model missing from the catalog cannot be estimated
+
+    @param model_name: Name of the model
+    """
+    print(f"Warning: no price known for model {model_name}, its costs are reported as null (add it to MODEL_CATALOG)")
+
+def format_cost(cost):
+    """
+    Formats a cost in $ for api responses (None stays None when the cost is unknown)
+
+    @param cost: Cost in $ or None
+    """
+    return f"{round(cost, 6):.6f} $" if cost is not None else None
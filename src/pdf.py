@@ -1,24 +1,303 @@
+import os
+import mmap
+import atexit
+import signal
+import tempfile
+import threading
+import multiprocessing
+import concurrent.futures
+
+from collections import deque
+
 from pypdf import PdfReader
 from io import BytesIO
 
+# Under this number of pages, process pool start-up costs more than it saves
+MIN_PAGES_FOR_PARALLEL_EXTRACTION = 16
+# Number of page ranges per worker (smaller ranges balance pathological pages across workers)
+PAGE_RANGES_PER_WORKER = 4
+
+class PageTimeoutError(Exception):
+    pass
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeoutError()
+
+def can_interrupt_extraction():
+    """
+    Whether page extraction can be interrupted with SIGALRM (main thread of a process on Unix systems,
+    always the case in extraction worker processes)
+    """
+    return hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+
+def extract_page_text_with_timeout(page,
+                                   page_timeout=None):
+    """
+    Extracts the text of a pdf page, raising PageTimeoutError if extraction exceeds page_timeout seconds.
+    Extraction is interrupted with SIGALRM when possible. Otherwise it runs in a watchdog thread that
+    is abandoned on timeout: the page keeps being parsed in background, so the pdf reader of the page
+    must not be used anymore.
+
+    @param page: pypdf page
+    @param page_timeout: Maximum number of seconds to spend on the page (None for no limit)
+    """
+    if not page_timeout:
+        return page.extract_text()
+    if not can_interrupt_extraction():
+        result = []
+        thread = threading.Thread(target=lambda: result.append(page.extract_text()), daemon=True)
+        thread.start()
+        thread.join(page_timeout)
+        if thread.is_alive():
+            raise PageTimeoutError()
+        return result[0] if result else ""
+    previous_handler = signal.signal(signal.SIGALRM, _raise_page_timeout)
+    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+    try:
+        return page.extract_text()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+def extract_page_text(page,
+                      page_timeout=None):
+    """
+    Extracts the text of a pdf page, returning an empty text if extraction exceeds page_timeout seconds
+    (see extract_page_text_with_timeout)
+
+    @param page: pypdf page
+    @param page_timeout: Maximum number of seconds to spend on the page (None for no limit)
+    """
+    try:
+        return extract_page_text_with_timeout(page, page_timeout=page_timeout)
+    except PageTimeoutError:
+        print(f"Skipping pdf page {page.page_number}: text extraction exceeded {page_timeout}s")
+        return ""
+
+# Process pools shared by all requests of the process (worker start-up is only paid once)
+_extraction_pools = {}
+_extraction_pools_lock = threading.Lock()
+
+def get_extraction_pool(max_workers):
+    """
+    Returns the process-wide pool of pdf extraction processes, creating it on first use (None if process
+    pools are not available, ex: AWS Lambda has no /dev/shm). Workers are started with forkserver (spawn
+    where unavailable): forking a multi-threaded server can deadlock children on locks held by other threads.
+
+    @param max_workers: Number of worker processes
+    """
+    with _extraction_pools_lock:
+        if max_workers not in _extraction_pools:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            try:
+                _extraction_pools[max_workers] = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                                                        mp_context=multiprocessing.get_context(start_method))
+            except (OSError, NotImplementedError, ValueError):
+                _extraction_pools[max_workers] = None
+        return _extraction_pools[max_workers]
+
+def discard_extraction_pool(max_workers):
+    """
+    Removes a broken pool (ex: a worker was killed) so that the next request creates a new one
+
+    @param max_workers: Number of worker processes of the pool
+    """
+    with _extraction_pools_lock:
+        executor = _extraction_pools.pop(max_workers, None)
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@atexit.register
+def shutdown_extraction_pools():
+    """
+    Stops worker processes of shared pools before interpreter shutdown
+    """
+    with _extraction_pools_lock:
+        executors = [executor for executor in _extraction_pools.values() if executor is not None]
+        _extraction_pools.clear()
+    for executor in executors:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def open_pdf_stream(pdf_file):
+    """
+    Opens a pdf source as a readable stream without copying its content in memory when possible.
+    Returns the stream and the memory map to close (None if no memory map was opened).
+
+    @param pdf_file: PDF file bytes, path to a pdf file or binary file object (ex: spooled temporary file)
+    """
+    if isinstance(pdf_file, (bytes, bytearray, memoryview)):
+        return BytesIO(pdf_file), None
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as file:
+            memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memory_map, memory_map
+    # File object: memory mapping its file descriptor if it has one (file on disk), using it as is otherwise
+    try:
+        memory_map = mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memory_map, memory_map
+    except (AttributeError, OSError, ValueError):
+        pdf_file.seek(0)
+        return pdf_file, None
+
+def extract_pages_text(pdf_source,
+                       page_indices,
+                       page_timeout=None):
+    """
+    Extracts the texts of pages at page_indices of a pdf file (runs in a worker process)
+
+    @param pdf_source: PDF file bytes or path to the pdf file
+    @param page_indices: Indices of pages to extract
+    @param page_timeout: Maximum number of seconds to spend on a page (None for no limit)
+    """
+    stream, memory_map = open_pdf_stream(pdf_source)
+    try:
+        pdf_file = PdfReader(stream)
+        return [extract_page_text(pdf_file.pages[i], page_timeout=page_timeout) for i in page_indices]
+    finally:
+        if memory_map is not None:
+            memory_map.close()
+
 class PDFDocument():
 
     def __init__(self,
-                 pdf_file):
+                 pdf_file,
+                 extraction_workers=1,
+                 page_timeout=None):
+        """
+        PDF Document from which to extract text and generate chunks. Pages are only loaded when their
+        text is extracted.
+
+        @param pdf_file: PDF file bytes, path to a pdf file or binary file object (files are memory mapped, not read)
+        @param extraction_workers: Number of processes used to extract page texts (None for number of cpus, 1 for serial extraction)
+        @param page_timeout: Maximum number of seconds to spend on a page before skipping it (None for no limit)
         """
-        PDF Document from which to extract text and generate chunks.
+        # Opening pdf file from its source
+        self.pdf_source = pdf_file
+        self.stream, self.memory_map = open_pdf_stream(pdf_file)
+        self.pdf_file = PdfReader(self.stream)
+        self.extraction_workers = extraction_workers or os.cpu_count() or 1
+        self.page_timeout = page_timeout
+        # Memory maps of pdf readers reopened after abandoned extractions (closed with the document)
+        self.extra_memory_maps = []
 
-        @param pdf_file: PDF file bytes        
+    def get_worker_source(self):
         """
-        # Opening pdf file from bytes
-        self.pdf_file = PdfReader(BytesIO(pdf_file))
-    
+        Returns the pdf source to send to extraction worker processes: the path when the pdf is a
+        named file on disk (workers map it themselves), the pdf bytes otherwise.
+        """
+        if isinstance(self.pdf_source, (bytes, str, os.PathLike)):
+            return self.pdf_source
+        name = getattr(self.pdf_source, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            return name
+        if self.memory_map is not None:
+            return self.memory_map[:]
+        self.stream.seek(0)
+        return self.stream.read()
+
+    def get_worker_path(self):
+        """
+        Returns the path of the pdf file to send to extraction worker processes and whether it is a temporary
+        file to delete once extraction is done: pdf bytes are written once to a temporary file so that they
+        are not pickled along with every page range.
+        """
+        worker_source = self.get_worker_source()
+        if not isinstance(worker_source, (bytes, bytearray, memoryview)):
+            return worker_source, False
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+            temp_file.write(worker_source)
+        return temp_file.name, True
+
+    def close(self):
+        """
+        Closes the memory map opened on the pdf file, if any
+        """
+        for memory_map in [self.memory_map, *self.extra_memory_maps]:
+            if memory_map is not None and not memory_map.closed:
+                memory_map.close()
+
+    @property
+    def nb_pages(self):
+        return len(self.pdf_file.pages)
+
+    def iter_page_texts(self,
+                        page_indices=None):
+        """
+        Yields the text content of the opened pdf file page by page (pages are extracted lazily)
+
+        @param page_indices: Indices of pages to extract (None for all pages)
+        """
+        page_indices = list(range(self.nb_pages)) if page_indices is None else page_indices
+        # Large documents are extracted in parallel (smaller ones in this process, with page timeouts enforced
+        # by a watchdog thread outside of the main thread, ex: Flask request threads, jobs and batch workers)
+        parallel = self.extraction_workers > 1 and len(page_indices) >= MIN_PAGES_FOR_PARALLEL_EXTRACTION
+        if parallel:
+            executor = get_extraction_pool(max_workers=self.extraction_workers)
+            if executor is not None:
+                yield from self.iter_page_texts_parallel(executor=executor, page_indices=page_indices)
+                return
+        yield from self.iter_page_texts_serial(page_indices=page_indices)
+
+    def iter_page_texts_serial(self,
+                               page_indices):
+        """
+        Yields page texts extracted in the current process
+
+        @param page_indices: Indices of pages to extract
+        """
+        pdf_file = self.pdf_file
+        for i in page_indices:
+            try:
+                yield extract_page_text_with_timeout(pdf_file.pages[i], page_timeout=self.page_timeout)
+            except PageTimeoutError:
+                print(f"Skipping pdf page {i + 1}: text extraction exceeded {self.page_timeout}s")
+                yield ""
+                if not can_interrupt_extraction():
+                    # The abandoned extraction thread still reads the pdf: next pages use their own reader
+                    stream, memory_map = open_pdf_stream(self.get_worker_source())
+                    self.extra_memory_maps.append(memory_map)
+                    pdf_file = PdfReader(stream)
+
+    def iter_page_texts_parallel(self,
+                                 executor,
+                                 page_indices):
+        """
+        Yields page texts in order while ranges of pages are extracted in parallel by a process pool
+        (results are released as soon as they are yielded)
+
+        @param executor: Process pool executor
+        @param page_indices: Indices of pages to extract
+        """
+        range_size = max(1, -(-len(page_indices) // (self.extraction_workers * PAGE_RANGES_PER_WORKER)))
+        ranges = deque(page_indices[start:start + range_size] for start in range(0, len(page_indices), range_size))
+        worker_path, is_temporary = self.get_worker_path()
+        futures = deque()
+        try:
+            try:
+                for page_range in ranges:
+                    futures.append(executor.submit(extract_pages_text, worker_path, page_range, self.page_timeout))
+            except concurrent.futures.BrokenExecutor:
+                pass
+            while ranges:
+                try:
+                    texts = futures.popleft().result()
+                except (concurrent.futures.BrokenExecutor, IndexError):
+                    # A worker died (ex: out of memory): remaining pages are extracted in this process
+                    discard_extraction_pool(max_workers=self.extraction_workers)
+                    yield from self.iter_page_texts_serial(page_indices=[i for page_range in ranges for i in page_range])
+                    return
+                ranges.popleft()
+                yield from texts
+        finally:
+            # Pending extractions are not needed anymore when iteration stops early
+            for future in futures:
+                future.cancel()
+            if is_temporary:
+                os.remove(worker_path)
+
     def extract_text(self):
         """
-        Extracts the text content from the opened pdf file        
+        Extracts the text content from the opened pdf file
         """
         # Extract text from all pages
-        text_content = []
-        for page in self.pdf_file.pages:
-            text_content.append(page.extract_text())
-        return "\n\n".join(text_content)
+        return "\n\n".join(self.iter_page_texts())
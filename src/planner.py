@@ -0,0 +1,102 @@
+"""
+Content budget planning: sizes document ingestion (extraction, chunking, embeddings) to the requested output
+"""
+import math
+
+from src.utils import get_evenly_spaced_indices
+
+# Rough number of characters of text on a pdf page (used before any page is extracted)
+ESTIMATED_CHARS_PER_PAGE = 3000
+# Number of chunks of content kept for flashcards generation
+FLASHCARDS_CHUNKS = 12
+# Content is sampled only when it exceeds the budget by this factor
+SAMPLING_MARGIN = 1.5
+# Chunk selection modes: ranked on embeddings, ranked locally, or picked evenly without ranking
+RETRIEVAL_MODES = ["auto", "embeddings", "local", "none"]
+# Embeddings are skipped when there are fewer than this number of candidate chunks per question
+MIN_CHUNKS_PER_QUESTION_FOR_EMBEDDINGS = 2
+
+class ContentPlan():
+    def __init__(self,
+                 strategy,
+                 budget_chunks=None,
+                 nb_pages=None,
+                 page_indices=None,
+                 max_chunks=None):
+        """
+        Processing plan of a document content
+
+        @param strategy: Name of the strategy ("full", "page_sampling" or "chunk_sampling")
+        @param budget_chunks: Number of chunks of content needed for the requested output (None if unbounded)
+        @param nb_pages: Number of pages of the document (pdf only)
+        @param page_indices: Indices of pages to extract (None for all pages)
+        @param max_chunks: Maximum number of chunks to keep after chunking (None for all chunks)
+        """
+        self.strategy = strategy
+        self.budget_chunks = budget_chunks
+        self.nb_pages = nb_pages
+        self.page_indices = page_indices
+        self.max_chunks = max_chunks
+
+    def should_embed(self,
+                     nb_chunks,
+                     num_questions):
+        """
+        Whether chunks should be embedded to retrieve relevant content. Without enough candidate chunks
+        per question, retrieval is not worth an embedding call and chunks are picked evenly instead.
+
+        @param nb_chunks: Number of chunks of the document
+        @param num_questions: Number of questions to generate
+        """
+        if num_questions <= 0:
+            return False
+        if self.budget_chunks is None:
+            # Planning disabled: embedding as soon as there are more chunks than questions
+            return nb_chunks > num_questions
+        return nb_chunks >= num_questions * MIN_CHUNKS_PER_QUESTION_FOR_EMBEDDINGS
+
+    def to_dict(self):
+        return (
+            {
+                "strategy": self.strategy,
+                "budgetChunks": self.budget_chunks,
+                "nbPages": self.nb_pages,
+                "nbSelectedPages": len(self.page_indices) if self.page_indices is not None else self.nb_pages,
+                "maxChunks": self.max_chunks
+            }
+        )
+
+def plan_content_processing(num_questions,
+                            flashcards_requested,
+                            chunk_size,
+                            sampled_chunks_per_question,
+                            nb_pages=None,
+                            content_length=None):
+    """
+    Chooses how much of a document to process according to the requested output. Large documents are
+    sampled (stratified, evenly spaced pages or chunks) so that latency and cost grow with the number of
+    requested questions and not with the size of the document.
+
+    @param num_questions: Number of questions to generate
+    @param flashcards_requested: Whether flashcards are generated
+    @param chunk_size: Size of chunks in characters (approximated as 4 characters per token in tokens mode)
+    @param sampled_chunks_per_question: Number of candidate chunks kept per question (0 to disable planning)
+    @param nb_pages: Number of pages of the document if it is paginated (pdf)
+    @param content_length: Length of the content in characters if already known
+    """
+    if not sampled_chunks_per_question:
+        return ContentPlan(strategy="full")
+    budget_chunks = max(num_questions * sampled_chunks_per_question, FLASHCARDS_CHUNKS if flashcards_requested else 0, 1)
+    budget_length = budget_chunks * chunk_size
+    if nb_pages is not None and nb_pages * ESTIMATED_CHARS_PER_PAGE > budget_length * SAMPLING_MARGIN:
+        nb_selected_pages = min(nb_pages, math.ceil(budget_length / ESTIMATED_CHARS_PER_PAGE))
+        return ContentPlan(strategy="page_sampling",
+                           budget_chunks=budget_chunks,
+                           nb_pages=nb_pages,
+                           page_indices=get_evenly_spaced_indices(nb_items=nb_pages, nb_selected=nb_selected_pages),
+                           max_chunks=budget_chunks)
+    if content_length is not None and content_length > budget_length * SAMPLING_MARGIN:
+        return ContentPlan(strategy="chunk_sampling",
+                           budget_chunks=budget_chunks,
+                           max_chunks=budget_chunks)
+    return ContentPlan(strategy="full", budget_chunks=budget_chunks, nb_pages=nb_pages)
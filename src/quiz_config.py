@@ -1,9 +1,14 @@
+import os
+
 from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
 
 from src.exception import InvalidInputDataException
 from src.templates import question_prompt_template, flashcards_prompt_template, retrieval_query
 from src.utils import load_config
+from src.cache import get_cache, get_disk_budget, VectorStoreRegistry
+from src.clients import get_client
+from src.planner import RETRIEVAL_MODES
 
 config = load_config()
 
@@ -15,19 +20,97 @@ class QuizConfig():
                  min_text_length,
                  chunk_size,
                  chunk_overlap,
-                 local_vector_store_path):
+                 local_vector_store_path=None,
+                 chunking_mode="characters",
+                 pdf_extraction_workers=1,
+                 pdf_page_timeout=None,
+                 sampled_chunks_per_question=0,
+                 retrieval_mmr_lambda=0.5,
+                 index_backend="auto",
+                 retrieval_mode="auto",
+                 local_ranking_max_chunks=200,
+                 max_concurrency=1,
+                 cache_dir=None,
+                 cache_max_disk_size_mb=320,
+                 response_cache_size=128,
+                 prompt_cache_size=1024,
+                 prompt_cache_ttl_hours=168,
+                 embedding_cache_size=4096,
+                 http_cache_size=32,
+                 http_cache_memory_mb=32,
+                 web_text_cache_size=256,
+                 html_parser="auto",
+                 max_web_page_size_mb=10,
+                 crawl_depth=0,
+                 crawl_max_pages=10,
+                 crawl_workers=4,
+                 crawl_scope="same_host",
+                 http_max_connections=32,
+                 http_keepalive_seconds=60):
         # Setting up configuration attrivutes
         self.embedding_batch_size = embedding_batch_size
         self.min_text_length = min_text_length
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.chunking_mode = chunking_mode
+        self.pdf_extraction_workers = pdf_extraction_workers
+        self.pdf_page_timeout = pdf_page_timeout
+        self.sampled_chunks_per_question = sampled_chunks_per_question
+        self.retrieval_mmr_lambda = retrieval_mmr_lambda
+        self.index_backend = index_backend
+        self.retrieval_mode = retrieval_mode
+        self.html_parser = html_parser
+        self.max_web_page_size_mb = max_web_page_size_mb
+        self.crawl_depth = crawl_depth
+        self.crawl_max_pages = crawl_max_pages
+        self.crawl_workers = crawl_workers
+        self.crawl_scope = crawl_scope
+        self.local_ranking_max_chunks = local_ranking_max_chunks
         self.question_prompt_template = question_prompt_template
         self.flashcards_prompt_template = flashcards_prompt_template
         self.retrieval_query = retrieval_query
-        self.local_vector_store_path = local_vector_store_path
-        # Building LLM and embeddings models
-        self.llm = ChatOpenAI(model=model_name)
-        self.embedding_model = OpenAIEmbeddings(model=embdeddings_model_name)
+        self.max_concurrency = max_concurrency
+        # Shared response cache (in-memory LRU + optional disk tier under cache_dir)
+        self.response_cache = get_cache("responses",
+                                        max_entries=response_cache_size,
+                                        cache_dir=cache_dir,
+                                        max_disk_size_mb=cache_max_disk_size_mb)
+        # Shared cache of structured LLM outputs per formatted prompt
+        self.prompt_cache = get_cache("prompts",
+                                      max_entries=prompt_cache_size,
+                                      cache_dir=cache_dir,
+                                      max_disk_size_mb=cache_max_disk_size_mb,
+                                      ttl_seconds=prompt_cache_ttl_hours * 3600 if prompt_cache_ttl_hours else None)
+        # Shared cache of chunk embeddings (float32 arrays)
+        self.embedding_cache = get_cache("embeddings",
+                                         max_entries=embedding_cache_size,
+                                         cache_dir=cache_dir,
+                                         max_disk_size_mb=cache_max_disk_size_mb)
+        # Shared caches of fetched web pages (http responses) and of their extracted texts
+        self.http_cache = get_cache("http",
+                                    max_entries=http_cache_size,
+                                    cache_dir=cache_dir,
+                                    max_disk_size_mb=cache_max_disk_size_mb,
+                                    max_memory_size_mb=http_cache_memory_mb)
+        self.web_text_cache = get_cache("web_texts",
+                                        max_entries=web_text_cache_size,
+                                        cache_dir=cache_dir,
+                                        max_disk_size_mb=cache_max_disk_size_mb)
+        # Registry of persisted vector stores (in a dedicated vector_stores directory under local_vector_store_path,
+        # if given, or under cache_dir), sharing the disk budget of disk caches
+        vector_store_registry_root = local_vector_store_path or cache_dir
+        vector_store_registry_dir = os.path.join(vector_store_registry_root, "vector_stores") if vector_store_registry_root else None
+        self.vector_store_registry = VectorStoreRegistry(root_dir=vector_store_registry_dir,
+                                                         disk_budget=get_disk_budget(max_size_mb=cache_max_disk_size_mb)) if vector_store_registry_dir else None
+        # Reusing process-wide LLM and embeddings clients (pooled keep-alive connections shared across requests)
+        self.llm = get_client(ChatOpenAI,
+                              model=model_name,
+                              max_connections=http_max_connections,
+                              keepalive_seconds=http_keepalive_seconds)
+        self.embedding_model = get_client(OpenAIEmbeddings,
+                                          model=embdeddings_model_name,
+                                          max_connections=http_max_connections,
+                                          keepalive_seconds=http_keepalive_seconds)
     
     def parse_input_data(self,
                          data):
@@ -48,6 +131,24 @@ class QuizConfig():
             if not arg_value:
                 raise InvalidInputDataException(message=f"Must provide {arg} argument")
             self.__setattr__(arg, arg_value)
+        # Flashcards generation is optional (used to plan content processing)
+        self.flashcards_requested = bool(data.get("generate_flashcards", False))
+        # Chunk selection mode can be chosen per request (configured mode otherwise)
+        retrieval_mode = data.get("retrieval_mode")
+        if retrieval_mode:
+            if retrieval_mode not in RETRIEVAL_MODES:
+                raise InvalidInputDataException(message=f"Argument retrieval_mode must be one of {RETRIEVAL_MODES}")
+            self.retrieval_mode = retrieval_mode
+        # Linked pages of a url can be crawled per request (bounded by the configured crawl_max_pages)
+        crawl_depth = data.get("crawl_depth")
+        if crawl_depth is not None:
+            try:
+                crawl_depth = int(crawl_depth)
+            except Exception as e:
+                raise InvalidInputDataException(message=f"Couldn't parse crawl_depth to integer")
+            if crawl_depth < 0:
+                raise InvalidInputDataException(message=f"Argument crawl_depth must be positive")
+            self.crawl_depth = crawl_depth
         # Checking if settings arguments are parsable and > 0
         for arg in config["forced_positive_arguments"]:
             try:
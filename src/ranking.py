@@ -0,0 +1,121 @@
+"""
+Embedding-free relevance ranking of text chunks (BM25 and TextRank on TF-IDF vectors, computed in-process)
+"""
+import re
+
+import numpy as np
+from langchain_core.documents import Document as LangchainDocument
+
+from src.vector_store import select_diverse
+
+# BM25 parameters (term frequency saturation and length normalization)
+BM25_K1 = 1.5
+BM25_B = 0.75
+# TextRank damping factor and number of power iterations
+TEXTRANK_DAMPING = 0.85
+TEXTRANK_ITERATIONS = 50
+# Weight of query relevance (BM25) against centrality (TextRank) in local scores
+QUERY_WEIGHT = 0.5
+
+TOKEN_PATTERN = re.compile(r"\w{3,}")
+
+def tokenize(text):
+    """
+    Splits a text into lowercase word tokens of at least 3 characters
+
+    @param text: Text to tokenize
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def normalize_scores(scores):
+    """
+    Scales scores to [0, 1] (all zeros if scores are constant)
+
+    @param scores: Array of scores
+    """
+    score_range = scores.max() - scores.min() if len(scores) else 0
+    return (scores - scores.min()) / score_range if score_range > 0 else np.zeros_like(scores)
+
+
+class LocalRanker():
+    def __init__(self,
+                 chunks):
+        """
+        Ranks text chunks without any embedding call. Chunks are tokenized once into (chunk, term, count)
+        triplets from which BM25 query scores and TF-IDF vectors are computed with vectorized array operations.
+
+        @param chunks: Text chunks to rank
+        """
+        self.chunks = chunks
+        self.vocabulary = {}
+        chunk_ids, term_ids = [], []
+        for i, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            term_ids.extend(self.vocabulary.setdefault(token, len(self.vocabulary)) for token in tokens)
+            chunk_ids.extend([i] * len(tokens))
+        nb_terms = max(len(self.vocabulary), 1)
+        # Counting (chunk, term) pairs into a term frequency matrix (nb_chunks x nb_terms)
+        pair_counts = np.bincount(np.asarray(chunk_ids, dtype=np.int64) * nb_terms + np.asarray(term_ids, dtype=np.int64),
+                                  minlength=len(chunks) * nb_terms)
+        self.term_frequencies = pair_counts.reshape(len(chunks), nb_terms).astype(np.float32)
+        self.chunk_lengths = self.term_frequencies.sum(axis=1)
+        document_frequencies = (self.term_frequencies > 0).sum(axis=0)
+        self.idf = np.log1p((len(chunks) - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+
+    def get_similarities(self):
+        """
+        Returns the cosine similarities of chunks TF-IDF vectors (sublinear term frequencies)
+        """
+        tfidf = np.log1p(self.term_frequencies) * self.idf
+        tfidf /= np.maximum(np.linalg.norm(tfidf, axis=1, keepdims=True), 1e-12)
+        return tfidf @ tfidf.T
+
+    def bm25_scores(self,
+                    query):
+        """
+        Returns the BM25 score of every chunk for a query
+
+        @param query: Query text
+        """
+        term_ids = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not term_ids:
+            return np.zeros(len(self.chunks), dtype=np.float32)
+        frequencies = self.term_frequencies[:, term_ids]
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.chunk_lengths / max(self.chunk_lengths.mean(), 1e-12))
+        return (self.idf[term_ids] * frequencies * (BM25_K1 + 1) / (frequencies + length_norm[:, None])).sum(axis=1)
+
+    def textrank_scores(self,
+                        similarities):
+        """
+        Returns the TextRank centrality of every chunk on the similarity graph of chunks
+
+        @param similarities: Cosine similarities of chunks
+        """
+        similarities = similarities.copy()
+        np.fill_diagonal(similarities, 0)
+        # Chunks similar to no other chunk redistribute their score uniformly
+        row_sums = similarities.sum(axis=1, keepdims=True)
+        transitions = np.where(row_sums > 0, similarities / np.maximum(row_sums, 1e-12), 1 / len(self.chunks))
+        scores = np.full(len(self.chunks), 1 / len(self.chunks), dtype=np.float32)
+        for _ in range(TEXTRANK_ITERATIONS):
+            scores = (1 - TEXTRANK_DAMPING) / len(self.chunks) + TEXTRANK_DAMPING * (transitions.T @ scores)
+        return scores
+
+    def find_relevant_chunks(self,
+                             query,
+                             k=5,
+                             lambda_mult=0.5):
+        """
+        Retrieves central and query relevant chunks, diversified with maximal marginal relevance on
+        TF-IDF vectors. Returns langchain documents (like VectorStore) in selection order.
+
+        @param query: Query used for BM25 relevance
+        @param k: Number of chunks to retrieve
+        @param lambda_mult: Trade-off between relevance (1.0) and diversity (0.0)
+        """
+        if not self.chunks or k <= 0:
+            return []
+        similarities = self.get_similarities()
+        scores = (1 - QUERY_WEIGHT) * normalize_scores(self.textrank_scores(similarities)) + QUERY_WEIGHT * normalize_scores(self.bm25_scores(query))
+        selected = select_diverse(relevance=scores, similarities=similarities, k=k, lambda_mult=lambda_mult)
+        return [LangchainDocument(page_content=self.chunks[i]) for i in selected]
@@ -1,29 +1,23 @@
 import os
+import queue
+import threading
 import traceback
+import concurrent.futures
 from functools import reduce
 from tqdm import tqdm
 
 from langchain_core.prompts import PromptTemplate
 
-from src.exception import QuizGenerationException, FlashcardsGenerationException, InvalidInputDataException, NotImplementedException
+from src.exception import RAQAMException, QuizGenerationException, FlashcardsGenerationException, InvalidInputDataException, NotImplementedException
 from src.document import Document
-from src.web_page import WebPage
-from src.pdf import PDFDocument
-try:
-    from src.vector_store import VectorStore
-    FAISS_AVAILABLE = True
-except ImportError:
-    VectorStore = None
-    FAISS_AVAILABLE = False
 from src.quiz import Quiz, FlashCards
-from src.utils import get_questions_distribution, count_tokens
+from src.cache import hash_key
+from src.utils import get_questions_distribution, get_evenly_spaced_indices
+from src.planner import plan_content_processing
+from src.model_catalog import get_cost, format_cost, get_embedding_model_key
+from src.usage import UsageTracker
 from src.language_detection import detect_language, get_language_name, get_localized_prompts
 
-model_costs = {
-    "gpt-4o-mini": {"input": 0.075, "output": 0.600},
-    "text-embedding-3-small": {"input": 0.020}
-}
-
 class QuizGenerator():
     def __init__(self,
                  llm,
@@ -42,7 +36,31 @@ class QuizGenerator():
                  youtube_url=None,
                  pdf_file=None,
                  video_file=None,
-                 local_vector_store_path=None):
+                 vector_store_registry=None,
+                 max_concurrency=1,
+                 response_cache=None,
+                 prompt_cache=None,
+                 embedding_cache=None,
+                 http_cache=None,
+                 web_text_cache=None,
+                 html_parser="auto",
+                 max_web_page_size_mb=10,
+                 crawl_depth=0,
+                 crawl_max_pages=10,
+                 crawl_workers=4,
+                 crawl_scope="same_host",
+                 chunking_mode="characters",
+                 pdf_extraction_workers=1,
+                 pdf_page_timeout=None,
+                 sampled_chunks_per_question=0,
+                 flashcards_requested=False,
+                 retrieval_mmr_lambda=0.5,
+                 index_backend="auto",
+                 retrieval_mode="auto",
+                 local_ranking_max_chunks=200,
+                 progress_callback=None,
+                 llm_semaphore=None,
+                 prepare_retrieval=True):
         """
         Quiz generator working with retrieval on .pdf embedded content. 
         
@@ -60,18 +78,51 @@ class QuizGenerator():
         @param text_content: Text content to use for quiz generation
         @param url: URL for which to extract text for quiz generation
         @param youtube_url: URL for a youtube video from which to extract content
-        @param pdf_filepath: Filepath to .pdf file for which to extract text for quiz generation
+        @param pdf_file: .pdf file (bytes, filepath or binary file object) for which to extract text for quiz generation
         @param video_filepath: Filepath to video file from which to extract content
-        @param local_vector_store_path: Path where to save vector store to avoid multiplying embeddings generation
+        @param vector_store_registry: Registry of persisted vector stores keyed by document fingerprint and embedding model (None to disable)
+        @param max_concurrency: Maximum number of LLM calls in flight at the same time (1 keeps generation sequential)
+        @param response_cache: Cache of full quiz / flashcards responses keyed by content and settings (None to disable)
+        @param prompt_cache: Cache of structured LLM outputs keyed by formatted prompt, model and schema (None to disable)
+        @param embedding_cache: Cache of chunk embeddings keyed by embedding model and chunk hash (None to disable)
+        @param http_cache: Cache of fetched web pages honoring http caching headers (None to disable)
+        @param web_text_cache: Cache of texts extracted from web pages (None to disable)
+        @param html_parser: HTML parser backend of web pages ("auto" uses lxml when installed, "lxml" or "html.parser")
+        @param max_web_page_size_mb: Maximum size of downloaded web pages in MB
+        @param crawl_depth: Number of links followed from the url to crawl linked pages (0 to process the url page only)
+        @param crawl_max_pages: Maximum number of web pages fetched when crawling
+        @param crawl_workers: Number of web pages fetched at the same time when crawling
+        @param crawl_scope: Linked pages crawled: "same_host" or "same_path" (under the url directory)
+        @param chunking_mode: "characters" or "tokens" (chunk_size and chunk_overlap are then expressed in tokens)
+        @param pdf_extraction_workers: Number of processes extracting pdf pages (None for number of cpus, 1 for serial extraction)
+        @param pdf_page_timeout: Maximum number of seconds spent extracting a pdf page before skipping it
+        @param sampled_chunks_per_question: Candidate chunks kept per question when sampling large documents (0 to process whole documents)
+        @param flashcards_requested: Whether flashcards will be generated (used to plan content processing)
+        @param retrieval_mmr_lambda: Relevance / diversity trade-off of retrieved chunks (1.0 for pure relevance)
+        @param retrieval_mode: Chunk selection mode ("auto", "embeddings", "local" for in-process BM25/TextRank ranking, "none" for evenly spaced chunks)
+        @param local_ranking_max_chunks: In "auto" mode, documents up to this number of chunks are ranked locally instead of embedded
+        @param progress_callback: Function called with (stage, completed, total) as pipeline stages start and LLM calls complete
+        @param llm_semaphore: Semaphore bounding LLM calls in flight, shared by several generators (None to bound this generator with max_concurrency)
+        @param prepare_retrieval: Whether to embed or rank chunks right away (False to call prepare_retrieval later, ex: after batching embeddings of several documents)
+        @param index_backend: Vector index backend ("auto" sizes it to the number of chunks, "numpy", "faiss_flat" or "faiss_hnsw")
         """
         # Setting-up class attributes
-        self.quiz_llm = llm.with_structured_output(schema=Quiz)
-        self.flaschards_llm = llm.with_structured_output(schema=FlashCards)
+        # Raw messages are kept alongside parsed outputs to read provider-reported token usage
+        self.quiz_llm = llm.with_structured_output(schema=Quiz, include_raw=True)
+        self.flaschards_llm = llm.with_structured_output(schema=FlashCards, include_raw=True)
         self.embedding_model = embedding_model
         self.embedding_batch_size = embedding_batch_size
         self.min_text_length = min_text_length
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.chunking_mode = chunking_mode
+        self.pdf_extraction_workers = pdf_extraction_workers
+        self.pdf_page_timeout = pdf_page_timeout
+        self.sampled_chunks_per_question = sampled_chunks_per_question
+        self.flashcards_requested = flashcards_requested
+        self.retrieval_mmr_lambda = retrieval_mmr_lambda
+        self.index_backend = index_backend
+        self.local_ranking_max_chunks = local_ranking_max_chunks
         self.question_prompt_template = question_prompt_template
         self.flashcards_prompt_template = flashcards_prompt_template
         self.retrieval_query = retrieval_query
@@ -82,19 +133,68 @@ class QuizGenerator():
         self.youtube_url = youtube_url if youtube_url != '' else None
         self.pdf_file = pdf_file
         self.video_file = video_file
-        self.local_vector_store_path = local_vector_store_path
+        self.vector_store_registry = vector_store_registry
+        self.max_concurrency = max(1, int(max_concurrency or 1))
+        self.response_cache = response_cache
+        self.response_cache_status = {}
+        self.prompt_cache = prompt_cache
+        self.prompt_cache_hits = 0
+        self.prompt_cache_misses = 0
+        self.embedding_cache = embedding_cache
+        self.http_cache = http_cache
+        self.web_text_cache = web_text_cache
+        self.html_parser = html_parser
+        self.max_web_page_size_mb = max_web_page_size_mb
+        self.crawl_depth = crawl_depth
+        self.crawl_max_pages = crawl_max_pages
+        self.crawl_workers = crawl_workers
+        self.crawl_scope = crawl_scope
+        # Bounding LLM calls in flight and protecting counters updated from worker threads
+        self.llm_semaphore = llm_semaphore or threading.BoundedSemaphore(self.max_concurrency)
+        self.counters_lock = threading.Lock()
+        # Progress reporting (pipeline stage and number of completed / planned LLM calls)
+        self.progress_callback = progress_callback
+        self.planned_llm_calls = 0
+        self.completed_llm_calls = 0
         # Saving generation data
         self.model_name = llm.model_name
         self.embedding_model_name = embedding_model.model
-        self.prompts_tokens = 0
-        self.responses_tokens = 0
-        self.embeddings_tokens = 0
+        # Embedding model name and dimensions (vectors of a model shortened to other dimensions are not interchangeable)
+        self.embedding_model_key = get_embedding_model_key(embedding_model)
+        self.usage = UsageTracker(model_name=self.model_name, embedding_model_name=self.embedding_model_name)
         # Building text document from input sources (text content > url > pdf filepath)
+        self.report_progress(stage="extracting_content")
         self.build_text_document()
         # Detect language from the content
         self.detect_and_set_language()
-        # Performing embedding on text document's text chunks if necessary (will be None if only one chunk)
-        self.vector_store = self.create_vector_store()
+        # Choosing how relevant chunks are selected now that the number of chunks is known
+        self.retrieval_mode = self.resolve_retrieval_mode(retrieval_mode=retrieval_mode)
+        # Looking for an already generated quiz before paying for embeddings
+        self.cached_quiz = self.get_cached_response(kind="quiz")
+        self.vector_store = None
+        self.local_ranker = None
+        if prepare_retrieval:
+            self.prepare_retrieval()
+
+    def prepare_retrieval(self,
+                          chunk_embeddings=None):
+        """
+        Performs embedding (or local ranking) on text document's text chunks if necessary (nothing if there is no chunk to rank)
+
+        @param chunk_embeddings: Embeddings of text chunks already generated (None to generate them)
+        """
+        self.vector_store = self.create_vector_store(chunk_embeddings=chunk_embeddings) if self.cached_quiz is None and self.retrieval_mode == "embeddings" else None
+        self.local_ranker = self.create_local_ranker() if self.cached_quiz is None and self.retrieval_mode == "local" else None
+
+    @property
+    def needs_embeddings(self):
+        """
+        Whether text chunks still have to be embedded (no cached quiz and no persisted vector store)
+        """
+        if self.cached_quiz is not None or self.retrieval_mode != "embeddings":
+            return False
+        vector_store_path = self.get_vector_store_path()
+        return vector_store_path is None or not os.path.isdir(vector_store_path)
 
     def build_text_document(self):
         """
@@ -103,23 +203,79 @@ class QuizGenerator():
         sources_arguments = ["text_content", "url", "youtube_url", "pdf_file", "video_file"]
         if not any([arg_value is not None for arg_value in sources_arguments]):
             raise InvalidInputDataException(message=f"Must provide at least one data source argument")
+        pdf_document = None
         if self.text_content is not None:
             text_contents = [self.text_content]
             self.content_source = "text"
         elif self.url is not None:
-            web_page = WebPage(url=self.url)
-            text_contents = [web_page.extract_text()]
+            # Content source modules are imported on demand to keep cold starts light (bs4, requests, pypdf)
+            from src.web_page import WebPage, WebCrawler
+            page_settings = {"http_cache": self.http_cache,
+                             "text_cache": self.web_text_cache,
+                             "parser": self.html_parser,
+                             "max_page_size_mb": self.max_web_page_size_mb}
+            if self.crawl_depth and self.crawl_depth > 0:
+                # Crawled pages are kept as separate parts of the document
+                web_crawler = WebCrawler(url=self.url,
+                                         max_depth=self.crawl_depth,
+                                         max_pages=self.crawl_max_pages,
+                                         workers=self.crawl_workers,
+                                         scope=self.crawl_scope,
+                                         **page_settings)
+                text_contents = web_crawler.crawl()
+            else:
+                text_contents = [WebPage(url=self.url, **page_settings).extract_text()]
             self.content_source = "web_page"
         elif self.youtube_url is not None:
             raise NotImplementedException()
         elif self.pdf_file is not None:
-            pdf_document = PDFDocument(pdf_file=self.pdf_file)
-            text_contents = [pdf_document.extract_text()]
+            from src.pdf import PDFDocument
+            pdf_document = PDFDocument(pdf_file=self.pdf_file,
+                                       extraction_workers=self.pdf_extraction_workers,
+                                       page_timeout=self.pdf_page_timeout)
+            # Planning which pages to extract from the number of pages, before extracting any of them
+            self.plan_content_processing(nb_pages=pdf_document.nb_pages)
+            # Streaming pages into the text splitter instead of joining the whole document text
+            text_contents = pdf_document.iter_page_texts(page_indices=self.content_plan.page_indices)
             self.content_source = "pdf_file"
         elif self.video_file is not None:
             raise NotImplementedException()            
+        if pdf_document is None:
+            self.plan_content_processing(content_length=sum([len(text) for text in text_contents]))
         # Building text document from extracted text content
-        self.text_document = Document(text_data=text_contents, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        self.text_document = Document(text_data=text_contents,
+                                      chunk_size=self.chunk_size,
+                                      chunk_overlap=self.chunk_overlap,
+                                      chunking_mode=self.chunking_mode,
+                                      encoding_model_name=self.embedding_model_name,
+                                      merge_parts=self.content_source == "pdf_file")
+        if pdf_document is not None:
+            pdf_document.close()
+        # Fingerprinting normalized content (used as key for caches and vector store registry)
+        self.content_hash = self.text_document.content_hash
+        # Sampling chunks evenly when the document has more content than the planned budget
+        if self.content_plan.max_chunks is not None and len(self.text_document.text_chunks) > self.content_plan.max_chunks:
+            self.text_document.keep_chunks(get_evenly_spaced_indices(nb_items=len(self.text_document.text_chunks),
+                                                                     nb_selected=self.content_plan.max_chunks))
+
+    def plan_content_processing(self,
+                                nb_pages=None,
+                                content_length=None):
+        """
+        Plans how much of the content to process according to the requested output (see src.planner)
+
+        @param nb_pages: Number of pages of the document (pdf only)
+        @param content_length: Length of the content in characters if already known
+        """
+        # Chunk size is approximated in characters (4 characters per token) in tokens chunking mode
+        chunk_size = self.chunk_size * 4 if self.chunking_mode == "tokens" else self.chunk_size
+        self.content_plan = plan_content_processing(num_questions=self.num_questions,
+                                                    flashcards_requested=self.flashcards_requested,
+                                                    chunk_size=chunk_size,
+                                                    sampled_chunks_per_question=self.sampled_chunks_per_question,
+                                                    nb_pages=nb_pages,
+                                                    content_length=content_length)
+        print(f"Content processing plan: {self.content_plan.to_dict()}")
 
     def detect_and_set_language(self):
         """
@@ -142,15 +298,61 @@ class QuizGenerator():
         self.flashcards_prompt_template = localized_prompts['flashcards_prompt']
         self.retrieval_query = localized_prompts['retrieval_query']
     
+    def get_response_cache_key(self,
+                               kind):
+        """
+        Builds the response cache key from normalized content, generation settings, models and language
+
+        @param kind: Kind of response ("quiz" or "flashcards")
+        """
+        if kind == "quiz":
+            settings = {"num_questions": self.num_questions, "num_choices": self.num_choices, "retrieval_mmr_lambda": self.retrieval_mmr_lambda,
+                        "retrieval_mode": self.retrieval_mode,
+                        "prompt_template": self.question_prompt_template, "retrieval_query": self.retrieval_query}
+        else:
+            settings = {"prompt_template": self.flashcards_prompt_template}
+        settings = {**settings, "chunk_size": self.chunk_size, "chunk_overlap": self.chunk_overlap, "chunking_mode": self.chunking_mode,
+                    "content_plan": self.content_plan.to_dict()}
+        return hash_key(kind, self.content_hash, settings, self.model_name, self.embedding_model_key, self.detected_language)
+
+    def get_cached_response(self,
+                            kind):
+        """
+        Returns the cached response (Quiz or FlashCards) for this request or None on a miss
+
+        @param kind: Kind of response ("quiz" or "flashcards")
+        """
+        if self.response_cache is None:
+            return None
+        cached = self.response_cache.get_json(self.get_response_cache_key(kind=kind))
+        if cached is None:
+            return None
+        return Quiz.model_validate(cached) if kind == "quiz" else FlashCards.model_validate(cached)
+
+    def set_cached_response(self,
+                            kind,
+                            response):
+        """
+        Stores a generated response (Quiz or FlashCards) in the response cache
+
+        @param kind: Kind of response ("quiz" or "flashcards")
+        @param response: Generated response to store
+        """
+        self.response_cache_status[kind] = "miss"
+        if self.response_cache is not None:
+            self.response_cache.set_json(self.get_response_cache_key(kind=kind), response.model_dump())
+
     def get_context(self):
         """
         Builds a dictionnary containing informations about quiz generation        
         """
         # Calculating costs foe every request on api
-        self.prompts_cost = (self.prompts_tokens / 1e6) * model_costs[self.model_name]["input"]
-        self.responses_cost = (self.responses_tokens / 1e6) * model_costs[self.model_name]["output"]
-        self.embeddings_cost = (self.embeddings_tokens / 1e6) * model_costs[self.embedding_model_name]["input"]
-        self.total_cost = self.prompts_cost + self.responses_cost + self.embeddings_cost
+        self.prompts_cost = get_cost(self.model_name, input_tokens=self.usage.prompts_tokens)
+        self.responses_cost = get_cost(self.model_name, output_tokens=self.usage.responses_tokens)
+        self.embeddings_cost = get_cost(self.embedding_model_name, input_tokens=self.usage.embeddings_tokens)
+        costs = [self.prompts_cost, self.responses_cost, self.embeddings_cost]
+        # Costs of models with unknown prices are null (and so is the total)
+        self.total_cost = sum(costs) if None not in costs else None
         return {
             "contentSource": self.content_source,
             "contentLanguage": self.language_name,
@@ -158,42 +360,191 @@ class QuizGenerator():
             "contentLength": self.text_document.content_length,
             "chunkSize": self.text_document.chunk_size,
             "chunkOverlap": self.text_document.chunk_overlap,
+            "chunkingMode": self.text_document.chunking_mode,
             "nbChunks": len(self.text_document.text_chunks),
             "generationModelName": self.model_name,
             "embeddingModelName": self.embedding_model_name,
             "hasEmbeddedChunks": self.vector_store is not None,
+            "contentPlan": self.content_plan.to_dict(),
+            "retrievalMode": self.retrieval_mode,
+            "responseCache": self.response_cache_status,
+            "promptCache": {
+                "hits": self.prompt_cache_hits,
+                "misses": self.prompt_cache_misses
+            },
             "tokens": {
-                "prompts": self.prompts_tokens,
-                "responses": self.responses_tokens,
-                "embeddings": self.embeddings_tokens,
-                "total": self.prompts_tokens + self.responses_tokens + self.embeddings_tokens 
+                "prompts": self.usage.prompts_tokens,
+                "responses": self.usage.responses_tokens,
+                "embeddings": self.usage.embeddings_tokens,
+                "total": self.usage.total_tokens
             },
             "costs": {
-                "prompts": f"{round(self.prompts_cost, 6):.6f} $",
-                "responses": f"{round(self.responses_cost, 6):.6f} $",
-                "embeddings": f"{round(self.embeddings_cost, 6):.6f} $",
-                "total": f"{round(self.total_cost, 6):.6f} $"
+                "prompts": format_cost(self.prompts_cost),
+                "responses": format_cost(self.responses_cost),
+                "embeddings": format_cost(self.embeddings_cost),
+                "total": format_cost(self.total_cost)
             }
         }
 
-    def create_vector_store(self):
+    def resolve_retrieval_mode(self,
+                               retrieval_mode):
+        """
+        Resolves the chunk selection mode. In "auto" mode, chunks are only ranked when there are enough
+        candidates per question (see ContentPlan.should_embed), locally for small documents and on
+        embeddings for documents with more than local_ranking_max_chunks chunks. Local ranking builds
+        dense chunks x vocabulary matrices, so larger documents are ranked on embeddings in every mode.
+
+        @param retrieval_mode: Requested mode ("auto", "embeddings", "local" or "none")
+        """
+        nb_chunks = len(self.text_document.text_chunks)
+        if retrieval_mode != "auto":
+            # Ranking a single candidate per question is useless whatever the requested mode
+            if not 0 < self.num_questions < nb_chunks:
+                return "none"
+            if retrieval_mode == "local" and nb_chunks > self.local_ranking_max_chunks:
+                print(f"Local ranking is limited to {self.local_ranking_max_chunks} chunks ({nb_chunks} chunks), ranking on embeddings")
+                return "embeddings"
+            return retrieval_mode
+        if not self.content_plan.should_embed(nb_chunks=nb_chunks, num_questions=self.num_questions):
+            return "none"
+        return "local" if nb_chunks <= self.local_ranking_max_chunks else "embeddings"
+
+    def create_local_ranker(self):
+        """
+        Creates the in-process ranker of document text chunks (no embedding call)
+        """
+        from src.ranking import LocalRanker
+        self.report_progress(stage="ranking_chunks")
+        return LocalRanker(chunks=self.text_document.text_chunks)
+
+    def get_vector_store_path(self):
+        """
+        Returns the registry directory of the vector store of this document (None without registry)
+        """
+        if self.vector_store_registry is None:
+            return None
+        from src.vector_store import VECTOR_STORE_FORMAT
+        fingerprint = hash_key(VECTOR_STORE_FORMAT, self.content_hash, self.chunk_size, self.chunk_overlap, self.chunking_mode, self.content_plan.to_dict())
+        return self.vector_store_registry.get_path(fingerprint=fingerprint,
+                                                   embedding_model_name=self.embedding_model_key)
+
+    def create_vector_store(self,
+                            chunk_embeddings=None):
         """
         Creates a vector store and performs embedding on document text chunks if necessary               
+
+        @param chunk_embeddings: Embeddings of text chunks already generated and accounted (None to generate them)
         """
-        if self.num_questions > 0 and len(self.text_document.text_chunks) > self.num_questions:
-            # Defining vector store and storing text chunks using embedding
-            vector_store = VectorStore(embedding_model=self.embedding_model,
-                                       embedding_batch_size=self.embedding_batch_size,
-                                       local_vector_store_path=self.local_vector_store_path)
-            if self.local_vector_store_path is None or not os.path.exists(self.local_vector_store_path):
+        # Vector store dependencies (numpy, faiss) are only imported when embeddings are used
+        from src.vector_store import VectorStore
+        # Looking for a vector store already built for this document and embedding model
+        vector_store_path = self.get_vector_store_path()
+        has_persisted_store = vector_store_path is not None and self.vector_store_registry.exists(vector_store_path)
+        vector_store = VectorStore(embedding_model=self.embedding_model,
+                                   embedding_batch_size=self.embedding_batch_size,
+                                   local_vector_store_path=vector_store_path if has_persisted_store else None,
+                                   embedding_cache=self.embedding_cache,
+                                   index_backend=self.index_backend)
+        # Storing text chunks using embedding when no persisted store was found
+        if not has_persisted_store:
+            if chunk_embeddings is not None:
+                # Embeddings generated (and accounted) together with other documents
+                vector_store.add_embeddings(chunks=self.text_document.text_chunks, embeddings=chunk_embeddings)
+            else:
                 print("Creating embeddings from extracted chunks and storing into vector store")
-                vector_store.add_embedded_chunks(chunks=self.text_document.text_chunks)
-                # Adding input tokens for embedding
-                self.embeddings_tokens += sum([count_tokens(chunk, self.embedding_model_name) for chunk in self.text_document.text_chunks])
-            # Saving vector store in local
-            if self.local_vector_store_path:
-                vector_store.save_vector_store(path=self.local_vector_store_path)
-            return vector_store
+                self.report_progress(stage="embedding_chunks")
+                embeddings_tokens = vector_store.add_embedded_chunks(chunks=self.text_document.text_chunks,
+                                                                     chunk_token_counts=self.text_document.chunk_token_counts)
+                # Adding input tokens for embedding (only chunks that were not found in embedding cache)
+                self.usage.add_embedding_usage(tokens=embeddings_tokens)
+            # Persisting vector store for next requests on the same document
+            if vector_store_path is not None:
+                self.vector_store_registry.save(path=vector_store_path,
+                                                save_function=lambda path: vector_store.save_vector_store(path=path))
+        return vector_store
+
+    def invoke_llm(self,
+                   llm,
+                   schema,
+                   formatted_prompt):
+        """
+        Invokes a structured output LLM while holding a slot of the concurrency budget. Parsed outputs
+        are looked up in / stored into the prompt cache so that an already processed prompt costs nothing.
+
+        @param llm: Structured output LLM to invoke
+        @param schema: Output schema of the LLM (Quiz or FlashCards)
+        @param formatted_prompt: Prompt to send to the LLM
+        """
+        if self.prompt_cache is not None:
+            cache_key = hash_key(formatted_prompt, self.model_name, schema.__name__)
+            cached = self.prompt_cache.get_json(cache_key)
+            with self.counters_lock:
+                if cached is not None:
+                    self.prompt_cache_hits += 1
+                else:
+                    self.prompt_cache_misses += 1
+            if cached is not None:
+                return schema.model_validate(cached)
+        with self.llm_semaphore:
+            result = llm.invoke(formatted_prompt)
+        if result["parsing_error"] is not None:
+            raise result["parsing_error"]
+        response = result["parsed"]
+        # Adding generated token for input and output (provider-reported usage, counted locally only if missing)
+        self.usage.add_generation_usage(usage_metadata=getattr(result["raw"], "usage_metadata", None),
+                                        formatted_prompt=formatted_prompt,
+                                        response=response)
+        if self.prompt_cache is not None:
+            self.prompt_cache.set_json(cache_key, response.model_dump())
+        return response
+
+    def report_progress(self,
+                        stage,
+                        completed=None,
+                        total=None):
+        """
+        Reports the current pipeline stage to the progress callback, if any
+
+        @param stage: Name of the stage ("extracting_content", "ranking_chunks", "embedding_chunks" or "generating")
+        @param completed: Number of completed steps of the stage
+        @param total: Number of planned steps of the stage
+        """
+        if self.progress_callback is not None:
+            self.progress_callback(stage=stage, completed=completed, total=total)
+
+    def map_concurrently(self,
+                         function,
+                         kwargs_list,
+                         desc,
+                         on_result=None):
+        """
+        Calls a function on each kwargs of a list with at most max_concurrency calls at the same time.
+        Results are returned in the same order as the input list.
+
+        @param function: Function to call
+        @param kwargs_list: List of keyword arguments, one per call
+        @param desc: Description for the progress bar
+        @param on_result: Function called on each result as soon as it is ready, in completion order (used for streaming)
+        """
+        # Counters are updated under the lock, progress is reported after releasing it (the progress callback
+        # may write to a job store, other LLM calls must not wait for it)
+        with self.counters_lock:
+            self.planned_llm_calls += len(kwargs_list)
+            completed, total = self.completed_llm_calls, self.planned_llm_calls
+        self.report_progress(stage="generating", completed=completed, total=total)
+        def call(kwargs):
+            result = function(**kwargs)
+            with self.counters_lock:
+                self.completed_llm_calls += 1
+                completed, total = self.completed_llm_calls, self.planned_llm_calls
+            self.report_progress(stage="generating", completed=completed, total=total)
+            if on_result is not None:
+                on_result(result)
+            return result
+        if self.max_concurrency == 1 or len(kwargs_list) <= 1:
+            return [call(kwargs) for kwargs in tqdm(kwargs_list, desc=desc)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(kwargs_list))) as executor:
+            return list(tqdm(executor.map(call, kwargs_list), total=len(kwargs_list), desc=desc))
 
     def generate_question(self,
                           content,
@@ -208,30 +559,63 @@ class QuizGenerator():
         prompt = PromptTemplate(input_variables=["num_questions", "content"], template=self.question_prompt_template)
         formatted_prompt = prompt.format(num_questions=num_questions, content=content)        
         # Generating question using LLM
-        response = self.quiz_llm.invoke(formatted_prompt)
-        # Adding generated token for input and output
-        self.prompts_tokens += count_tokens(text=formatted_prompt, model=self.model_name)
-        self.responses_tokens += count_tokens(text=response.json(), model=self.model_name)
+        response = self.invoke_llm(llm=self.quiz_llm, schema=Quiz, formatted_prompt=formatted_prompt)
         return response
 
-    def generate_quiz(self):
+    def generate_quiz(self,
+                      on_questions=None):
         """
         Generates a quiz on the stored document with prompt template using langchain retrieval chain.
+
+        @param on_questions: Function called with each batch of questions (Quiz) as soon as it is generated (used for streaming)
         """
+        # Streamed batches are randomized on their own copy (the complete quiz is randomized once all batches are done)
+        on_result = None
+        if on_questions is not None:
+            def on_result(questions):
+                questions = questions.model_copy(deep=True)
+                questions.randomize()
+                on_questions(questions)
         # Performing retrieval on full document to find relevant content for questions
         try:
-            if self.vector_store:
-                print("Extracting relevant chunks from embedded document")
-                relevant_content = self.vector_store.find_relevant_chunks(query=self.retrieval_query,
-                                                                          k=self.num_questions)
+            if self.cached_quiz is not None:
+                self.response_cache_status["quiz"] = "hit"
+                quiz = self.cached_quiz
+                # Randomizing again so that cached questions are not served in the same order
+                quiz.randomize()
+                if on_questions is not None:
+                    on_questions(quiz)
+                return quiz
+            if self.vector_store or self.local_ranker:
+                if self.vector_store:
+                    print("Extracting relevant chunks from embedded document")
+                    query_vector = self.embedding_model.embed_query(self.retrieval_query)
+                    relevant_content = self.vector_store.find_relevant_chunks_batch(query_vectors=[query_vector],
+                                                                                    k=self.num_questions,
+                                                                                    lambda_mult=self.retrieval_mmr_lambda)[0]
+                else:
+                    print("Ranking document chunks locally")
+                    relevant_content = self.local_ranker.find_relevant_chunks(query=self.retrieval_query,
+                                                                              k=self.num_questions,
+                                                                              lambda_mult=self.retrieval_mmr_lambda)
                 # Generating question for each content that has been found
                 print("Generating questions from relevant content")
-                quiz = [self.generate_question(content=content.page_content) for content in tqdm(relevant_content, desc="Generating questions")]
+                quiz = self.map_concurrently(function=self.generate_question,
+                                             kwargs_list=[{"content": content.page_content} for content in relevant_content],
+                                             desc="Generating questions",
+                                             on_result=on_result)
             else:
                 relevant_content = self.text_document.text_chunks  
+                # Without retrieval, picking chunks evenly through the document rather than the first ones
+                if len(relevant_content) > self.num_questions:
+                    relevant_content = [relevant_content[i] for i in get_evenly_spaced_indices(nb_items=len(relevant_content), nb_selected=self.num_questions)]
                 questions_distribution = get_questions_distribution(nb_text_chunks=len(relevant_content), num_questions=self.num_questions) 
-                quiz = [self.generate_question(num_questions=questions_distribution[i], content=content) for i, content in tqdm(enumerate(relevant_content), desc="Generating questions") if questions_distribution[i] > 0]          
+                quiz = self.map_concurrently(function=self.generate_question,
+                                             kwargs_list=[{"num_questions": questions_distribution[i], "content": content} for i, content in enumerate(relevant_content) if questions_distribution[i] > 0],
+                                             desc="Generating questions",
+                                             on_result=on_result)
             quiz = reduce(lambda x, y: x+y, quiz) 
+            self.set_cached_response(kind="quiz", response=quiz)
             # Randomizing questions and choices questions in order to avoid redondancy
             quiz.randomize()
             return quiz       
@@ -249,22 +633,31 @@ class QuizGenerator():
         prompt = PromptTemplate(input_variables=["content"], template=self.flashcards_prompt_template)
         formatted_prompt = prompt.format(content=content)        
         # Generating question using LLM
-        response = self.flaschards_llm.invoke(formatted_prompt)
-        # Adding generated token for input and output
-        self.prompts_tokens += count_tokens(text=formatted_prompt, model=self.model_name)
-        self.responses_tokens += count_tokens(text=response.json(), model=self.model_name)
+        response = self.invoke_llm(llm=self.flaschards_llm, schema=FlashCards, formatted_prompt=formatted_prompt)
         return response        
 
-    def generate_flashcards(self):
+    def generate_flashcards(self,
+                            on_flashcards=None):
         """
         Generates flashcards on the stored document with prompt template.        
+
+        @param on_flashcards: Function called with each batch of flashcards (FlashCards) as soon as it is generated (used for streaming)
         """
         try:
+            cached_flashcards = self.get_cached_response(kind="flashcards")
+            if cached_flashcards is not None:
+                self.response_cache_status["flashcards"] = "hit"
+                if on_flashcards is not None:
+                    on_flashcards(cached_flashcards)
+                return cached_flashcards
             # For better flashcard generation, we'll process content in larger chunks
             # to get more comprehensive flashcards rather than many small ones
             if len(self.text_document.text_chunks) <= 3:
                 # If we have few chunks, process each one
-                flashcards = [self.generate_flashcards_on_content(content=chunk) for chunk in tqdm(self.text_document.text_chunks, desc="Generating flashcards on content")]
+                flashcards = self.map_concurrently(function=self.generate_flashcards_on_content,
+                                                   kwargs_list=[{"content": chunk} for chunk in self.text_document.text_chunks],
+                                                   desc="Generating flashcards on content",
+                                                   on_result=on_flashcards)
             else:
                 # If we have many chunks, combine them into larger sections for better context
                 combined_chunks = []
@@ -274,9 +667,88 @@ class QuizGenerator():
                     combined_chunk = "\n\n".join(self.text_document.text_chunks[i:i+chunk_size])
                     combined_chunks.append(combined_chunk)
                 
-                flashcards = [self.generate_flashcards_on_content(content=chunk) for chunk in tqdm(combined_chunks, desc="Generating flashcards on content")]
+                flashcards = self.map_concurrently(function=self.generate_flashcards_on_content,
+                                                   kwargs_list=[{"content": chunk} for chunk in combined_chunks],
+                                                   desc="Generating flashcards on content",
+                                                   on_result=on_flashcards)
             
             flashcards = reduce(lambda x,y: x+y, flashcards)
+            self.set_cached_response(kind="flashcards", response=flashcards)
             return flashcards
         except Exception as e:
-            raise FlashcardsGenerationException(stack_trace=traceback.format_exc())        
+            raise FlashcardsGenerationException(stack_trace=traceback.format_exc())
+
+    def generate_quiz_and_flashcards(self,
+                                     generate_quiz=True,
+                                     generate_flashcards=True,
+                                     on_questions=None,
+                                     on_flashcards=None):
+        """
+        Generates quiz and flashcards at the same time. Both pipelines share the same LLM concurrency
+        budget (max_concurrency), so wall-clock time is driven by the slowest one instead of their sum.
+        Returns a (quiz, flashcards) tuple, with None for any output that was not requested.
+
+        @param generate_quiz: Whether to generate a quiz
+        @param generate_flashcards: Whether to generate flashcards
+        @param on_questions: Function called with each batch of questions as soon as it is generated
+        @param on_flashcards: Function called with each batch of flashcards as soon as it is generated
+        """
+        if not (generate_quiz and generate_flashcards):
+            quiz = self.generate_quiz(on_questions=on_questions) if generate_quiz else None
+            flashcards = self.generate_flashcards(on_flashcards=on_flashcards) if generate_flashcards else None
+            return quiz, flashcards
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            quiz_future = executor.submit(self.generate_quiz, on_questions=on_questions)
+            flashcards_future = executor.submit(self.generate_flashcards, on_flashcards=on_flashcards)
+            # Exceptions raised by a pipeline (QuizGenerationException, FlashcardsGenerationException) are re-raised here
+            flashcards = flashcards_future.result()
+            quiz = quiz_future.result()
+        return quiz, flashcards
+
+    def stream_quiz_and_flashcards(self,
+                                   generate_quiz=True,
+                                   generate_flashcards=True):
+        """
+        Generates quiz and flashcards like generate_quiz_and_flashcards but yields frames (dictionaries) as
+        soon as each LLM call finishes: "questions" and "flashcards" frames, then a final "quizContext" frame.
+        Errors raised once streaming has started are yielded as an "error" frame.
+
+        @param generate_quiz: Whether to generate a quiz
+        @param generate_flashcards: Whether to generate flashcards
+        """
+        frames = queue.Queue()
+        def generate():
+            try:
+                self.generate_quiz_and_flashcards(generate_quiz=generate_quiz,
+                                                  generate_flashcards=generate_flashcards,
+                                                  on_questions=lambda quiz: frames.put({"event": "questions", **quiz.to_dict()}),
+                                                  on_flashcards=lambda flashcards: frames.put({"event": "flashcards", **flashcards.to_dict()}))
+                frames.put({"event": "quizContext", "quizContext": self.get_context()})
+            except RAQAMException as e:
+                frames.put({"event": "error", "error": e.error, "message": e.message, "status_code": e.status_code, "stack_trace": e.stack_trace})
+            except Exception as e:
+                frames.put({"event": "error", "error": "InternalServerError", "message": str(e), "status_code": 500, "stack_trace": traceback.format_exc()})
+            finally:
+                # End of stream
+                frames.put(None)
+        # Generating in a background thread so that frames are yielded while LLM calls are still running
+        threading.Thread(target=generate, daemon=True).start()
+        while (frame := frames.get()) is not None:
+            yield frame
+
+    def build_output_data(self,
+                          quiz,
+                          flashcards):
+        """
+        Builds the response of a generation (flashcards, quiz and quizContext)
+
+        @param quiz: Generated quiz (None if not requested)
+        @param flashcards: Generated flashcards (None if not requested)
+        """
+        output_data = {}
+        if flashcards is not None:
+            output_data = {**output_data, **flashcards.to_dict()}
+        if quiz is not None:
+            output_data = {**output_data, **quiz.to_dict()}
+        output_data["quizContext"] = self.get_context()
+        return output_data
@@ -0,0 +1,57 @@
+import threading
+
+from src.utils import count_tokens
+
+
+class UsageTracker():
+    def __init__(self,
+                 model_name,
+                 embedding_model_name):
+        """
+        Thread-safe accounting of tokens used by a generation. Provider-reported usage is used whenever
+        available, tokens are only counted locally (cached tokenizer) when usage is missing.
+
+        @param model_name: Name of the generation model
+        @param embedding_model_name: Name of the embedding model
+        """
+        self.model_name = model_name
+        self.embedding_model_name = embedding_model_name
+        self.prompts_tokens = 0
+        self.responses_tokens = 0
+        self.embeddings_tokens = 0
+        self.lock = threading.Lock()
+
+    def add_generation_usage(self,
+                             usage_metadata=None,
+                             formatted_prompt=None,
+                             response=None):
+        """
+        Adds prompt and response tokens of an LLM call
+
+        @param usage_metadata: Usage reported by the provider (langchain usage_metadata dict) if any
+        @param formatted_prompt: Prompt sent to the LLM, counted locally when usage is missing
+        @param response: Parsed response of the LLM, counted locally when usage is missing
+        """
+        if usage_metadata:
+            prompt_tokens = usage_metadata.get("input_tokens", 0)
+            response_tokens = usage_metadata.get("output_tokens", 0)
+        else:
+            prompt_tokens = count_tokens(text=formatted_prompt, model=self.model_name)
+            response_tokens = count_tokens(text=response.model_dump_json(), model=self.model_name)
+        with self.lock:
+            self.prompts_tokens += prompt_tokens
+            self.responses_tokens += response_tokens
+
+    def add_embedding_usage(self,
+                            tokens):
+        """
+        Adds tokens sent to the embedding model
+
+        @param tokens: Number of embedding tokens
+        """
+        with self.lock:
+            self.embeddings_tokens += tokens
+
+    @property
+    def total_tokens(self):
+        return self.prompts_tokens + self.responses_tokens + self.embeddings_tokens
@@ -1,8 +1,12 @@
 import re
 import os
-import tiktoken
+import json
 import yaml
 import random
+import base64
+import tempfile
+
+from src.model_catalog import get_encoding
 
 def remove_headers_footers(text, header_patterns=None, footer_patterns=None):
     if header_patterns is None:
@@ -57,8 +61,19 @@ def get_questions_distribution(nb_text_chunks, num_questions):
         index = (index + 1) % nb_text_chunks
     return questions_distribution
 
+def get_evenly_spaced_indices(nb_items, nb_selected):
+    """
+    Returns nb_selected indices evenly spread over nb_items items (middle of nb_selected equal strata)
+
+    @param nb_items: Number of items
+    @param nb_selected: Number of indices to select
+    """
+    if nb_selected >= nb_items:
+        return list(range(nb_items))
+    return [int((i + 0.5) * nb_items / nb_selected) for i in range(nb_selected)]
+
 def count_tokens(text, model):
-    encoding = tiktoken.encoding_for_model(model)
+    encoding = get_encoding(model)
     return len(encoding.encode(text))
 
 def read_yaml(path):
@@ -131,4 +146,38 @@ def extract_key_concepts(text, max_concepts=10):
     
     # Remove duplicates and return top concepts
     unique_concepts = list(set(concepts))
-    return unique_concepts[:max_concepts]
\ No newline at end of file
+    return unique_concepts[:max_concepts]
+
+def write_base64_to_temp_file(data, suffix="", block_size=4 * 1024 * 1024):
+    """
+    Decodes base64 data into a temporary file block by block (the decoded content is never fully held
+    in memory) and returns the path of the file. The caller is responsible for removing the file.
+
+    @param data: Base64 encoded str
+    @param suffix: Suffix of the temporary file name
+    @param block_size: Number of base64 characters decoded at once (multiple of 4)
+    """
+    # Removing line breaks (MIME style base64) so that blocks stay aligned on 4 characters
+    if "\n" in data:
+        data = "".join(data.split())
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as file:
+        for start in range(0, len(data), block_size):
+            file.write(base64.b64decode(data[start:start + block_size]))
+        return file.name
+
+# Streaming response formats and their content types
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
+def format_stream_frame(frame, stream_format="ndjson"):
+    """
+    Serializes a streamed frame (dictionary with an "event" key) as a json line or a server-sent event
+
+    @param frame: Frame to serialize
+    @param stream_format: "ndjson" or "sse"
+    """
+    if stream_format == "sse":
+        return f"event: {frame['event']}\ndata: {json.dumps(frame)}\n\n"
+    return json.dumps(frame) + "\n"
@@ -1,71 +1,359 @@
 import os
+import json
+import hashlib
+import importlib.util
 import numpy as np
 
-import faiss
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
-
 import concurrent.futures
 
 from tqdm import tqdm
+from langchain_core.documents import Document as LangchainDocument
+
+from src.model_catalog import get_embedding_dimension, get_embedding_model_key
+from src.utils import count_tokens
+
+# faiss is only imported by faiss index backends (small documents never load it)
+FAISS_AVAILABLE = importlib.util.find_spec("faiss") is not None
+
+# Maximum number of tokens accepted by the embeddings endpoint in a single request
+EMBEDDING_BATCH_MAX_TOKENS = 300000
+# Maximum number of tokens of an embedding input (OpenAI embedding models), when the model does not tell
+EMBEDDING_CONTEXT_LENGTH = 8191
+# Number of embedding batches generated in parallel and added to the index at once
+EMBEDDING_WINDOW_BATCHES = 8
+# Version of the persisted vector store format (vectors.npy + chunks.json + index.json)
+VECTOR_STORE_FORMAT = "v2"
+# Automatic index backend selection by number of vectors
+NUMPY_INDEX_MAX_VECTORS = 2000
+FAISS_FLAT_INDEX_MAX_VECTORS = 50000
+# Number of neighbors per node of HNSW graphs
+HNSW_NEIGHBORS = 32
+
+
+class NumpyIndex():
+    def __init__(self,
+                 dimension):
+        """
+        Brute-force L2 index on a NumPy matrix (fastest for small numbers of vectors, no faiss import)
+
+        @param dimension: Dimension of vectors
+        """
+        self.dimension = dimension
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+
+    @property
+    def ntotal(self):
+        return len(self.vectors)
+
+    def add(self,
+            vectors):
+        self.vectors = np.vstack([self.vectors, vectors])
+
+    def search(self,
+               queries,
+               k):
+        """
+        Returns (distances, ids) arrays of the k nearest vectors of each query (ids are -1 when missing)
+        """
+        distances = (queries ** 2).sum(axis=1, keepdims=True) - 2 * queries @ self.vectors.T + (self.vectors ** 2).sum(axis=1)
+        k_found = min(k, self.ntotal)
+        ids = np.argpartition(distances, k_found - 1, axis=1)[:, :k_found]
+        ids = np.take_along_axis(ids, np.argsort(np.take_along_axis(distances, ids, axis=1), axis=1), axis=1)
+        padding = ((0, 0), (0, k - k_found))
+        return (np.pad(np.take_along_axis(distances, ids, axis=1), padding, constant_values=np.inf),
+                np.pad(ids, padding, constant_values=-1))
+
+    def reconstruct(self,
+                    ids):
+        return self.vectors[ids]
+
+
+class FaissIndex():
+    def __init__(self,
+                 dimension,
+                 kind="flat"):
+        """
+        Faiss index: exact search ("flat") or approximate search on a HNSW graph ("hnsw") for large numbers of vectors
+
+        @param dimension: Dimension of vectors
+        @param kind: "flat" or "hnsw"
+        """
+        import faiss
+        self.dimension = dimension
+        self.kind = kind
+        self.index = faiss.IndexFlatL2(dimension) if kind == "flat" else faiss.IndexHNSWFlat(dimension, HNSW_NEIGHBORS)
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def add(self,
+            vectors):
+        self.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def search(self,
+               queries,
+               k):
+        return self.index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+
+    def reconstruct(self,
+                    ids):
+        return np.vstack([self.index.reconstruct(int(i)) for i in ids])
+
+
+def create_index(dimension,
+                 nb_vectors,
+                 backend="auto"):
+    """
+    Creates the vector index backend sized to the number of vectors: NumPy brute-force for small
+    documents, faiss flat for medium documents and faiss HNSW for large documents.
+
+    @param dimension: Dimension of vectors
+    @param nb_vectors: Expected number of vectors
+    @param backend: "auto", "numpy", "faiss_flat" or "faiss_hnsw"
+    """
+    if backend == "auto":
+        if not FAISS_AVAILABLE or nb_vectors <= NUMPY_INDEX_MAX_VECTORS:
+            backend = "numpy"
+        elif nb_vectors <= FAISS_FLAT_INDEX_MAX_VECTORS:
+            backend = "faiss_flat"
+        else:
+            backend = "faiss_hnsw"
+    if backend == "numpy" or not FAISS_AVAILABLE:
+        return NumpyIndex(dimension=dimension)
+    return FaissIndex(dimension=dimension, kind="hnsw" if backend == "faiss_hnsw" else "flat")
+
+
+def select_diverse(relevance,
+                   similarities,
+                   k,
+                   lambda_mult=0.5):
+    """
+    Greedily selects k candidates maximizing relevance while minimizing similarity to already selected
+    candidates. Returns positions of selected candidates in selection order.
+
+    @param relevance: Relevance score of every candidate
+    @param similarities: Pairwise similarities of candidates (nb_candidates x nb_candidates)
+    @param k: Number of candidates to select
+    @param lambda_mult: Trade-off between relevance (1.0) and diversity (0.0)
+    """
+    max_similarity_to_selected = np.zeros(len(relevance), dtype=np.float32)
+    is_selected = np.zeros(len(relevance), dtype=bool)
+    selected = []
+    for _ in range(min(k, len(relevance))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity_to_selected
+        scores[is_selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        is_selected[best] = True
+        max_similarity_to_selected = np.maximum(max_similarity_to_selected, similarities[:, best])
+    return selected
+
+def maximal_marginal_relevance(query_vector,
+                               candidate_vectors,
+                               k,
+                               lambda_mult=0.5):
+    """
+    Selects k candidates maximizing relevance to the query while minimizing similarity to already selected
+    candidates (cosine similarities, vectorized). Returns positions of selected candidates in selection order.
+
+    @param query_vector: Query embedding
+    @param candidate_vectors: Candidate embeddings (nb_candidates x dimension)
+    @param k: Number of candidates to select
+    @param lambda_mult: Trade-off between relevance (1.0) and diversity (0.0)
+    """
+    candidate_vectors = candidate_vectors / np.maximum(np.linalg.norm(candidate_vectors, axis=1, keepdims=True), 1e-12)
+    query_vector = query_vector / max(np.linalg.norm(query_vector), 1e-12)
+    return select_diverse(relevance=candidate_vectors @ query_vector,
+                          similarities=candidate_vectors @ candidate_vectors.T,
+                          k=k,
+                          lambda_mult=lambda_mult)
 
 
 class VectorStore():
     def __init__(self,
                  embedding_model,
                  embedding_batch_size,
-                 local_vector_store_path=None):
+                 local_vector_store_path=None,
+                 embedding_cache=None,
+                 index_backend="auto"):
         """
-        FAISS Vectors Store with specific embeddings model
+        Vectors Store with specific embeddings model. The index backend (NumPy or faiss) is chosen according to
+        the number of chunks, all backends are saved and loaded with the same format (vectors + chunks).
 
         @param embedding_model: Model for embeddings to use for this vector store 
         @param embedding_batch_size: Size of batch for which to calculate embeddings      
         @param local_vector_store_path: Path to use to load vector store
+        @param embedding_cache: Cache of chunk embeddings (float32 bytes) keyed by model and chunk hash (None to disable)
+        @param index_backend: "auto" (chosen by number of chunks), "numpy", "faiss_flat" or "faiss_hnsw"
         """
         self.embedding_model = embedding_model
         self.embedding_batch_size = embedding_batch_size
-        if local_vector_store_path is None or not os.path.exists(local_vector_store_path):
-            # Creating index with faiss
-            index = faiss.IndexFlatL2(len(self.embedding_model.embed_query("hello world")))
-            # Creating vector store with corresponding embedding function and index
-            self.vector_store = FAISS(
-                embedding_function=self.embedding_model,
-                index=index,
-                docstore=InMemoryDocstore(),
-                index_to_docstore_id={},
-            ) 
+        self.embedding_cache = embedding_cache
+        self.index_backend = index_backend
+        self.index = None
+        self.chunks = []
+        if local_vector_store_path is not None and os.path.exists(local_vector_store_path):
+            self.load_vector_store(path=local_vector_store_path)
+
+    def get_embedding_cache_key(self,
+                                chunk):
+        """
+        Builds the embedding cache key of a chunk from the embedding model name and dimensions and the chunk text hash
+
+        @param chunk: Text chunk
+        """
+        return f"{get_embedding_model_key(self.embedding_model)}-{hashlib.sha256(chunk.encode('utf-8')).hexdigest()}"
+
+    def has_too_long_chunk(self,
+                           batch):
+        """
+        Tells if a chunk of the batch exceeds the embedding model context length (such chunks are split
+        and their embeddings averaged by the langchain client). Chunks are only tokenized when their
+        UTF-8 size exceeds the context length (a token is at least one byte).
+
+        @param batch: Batch of text chunks
+        """
+        context_length = getattr(self.embedding_model, "embedding_ctx_length", None) or EMBEDDING_CONTEXT_LENGTH
+        return any(len(chunk.encode("utf-8")) > context_length and count_tokens(chunk, self.embedding_model.model) > context_length
+                   for chunk in batch)
+
+    def embed_batch(self,
+                    batch,
+                    batch_tokens=None):
+        """
+        Generates embeddings for a batch of chunks. Returns embeddings and the number of input tokens
+        reported by the provider (taken from batch_tokens or counted locally when the provider does not
+        report usage).
+
+        @param batch: Batch of text chunks
+        @param batch_tokens: Number of tokens of the batch if already known
+        """
+        client = getattr(self.embedding_model, "client", None)
+        if client is not None and hasattr(client, "create") and not self.has_too_long_chunk(batch):
+            # Calling OpenAI embeddings endpoint directly to get usage (and avoid client-side tokenization),
+            # unless a chunk is too long for the endpoint and must be split by the langchain client
+            dimensions = getattr(self.embedding_model, "dimensions", None)
+            response = client.create(input=batch, model=self.embedding_model.model, **({"dimensions": dimensions} if dimensions else {}))
+            embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                return embeddings, usage.prompt_tokens
         else:
-            self.vector_store = FAISS.load_local(local_vector_store_path, self.embedding_model, allow_dangerous_deserialization=True)
-    
+            embeddings = self.embedding_model.embed_documents(batch)
+        if batch_tokens is not None:
+            return embeddings, batch_tokens
+        return embeddings, sum([count_tokens(chunk, self.embedding_model.model) for chunk in batch])
+
+    def split_into_batches(self,
+                           indices,
+                           chunk_token_counts=None):
+        """
+        Groups chunk indices into batches of at most embedding_batch_size chunks. When chunk token
+        counts are known, batches are also capped to EMBEDDING_BATCH_MAX_TOKENS tokens.
+
+        @param indices: Indices of chunks to embed
+        @param chunk_token_counts: Number of tokens of every chunk (None if unknown)
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for i in indices:
+            chunk_tokens = chunk_token_counts[i] if chunk_token_counts is not None else 0
+            if batch and (len(batch) >= self.embedding_batch_size or batch_tokens + chunk_tokens > EMBEDDING_BATCH_MAX_TOKENS):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += chunk_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
     def generate_embeddings(self,
-                            chunks):
+                            chunks,
+                            chunk_token_counts=None,
+                            per_chunk_tokens=False):
         """
-        Generates text embeddings for chunks by batch and with parallelization
+        Generates text embeddings for chunks by batch and with parallelization. Embeddings found in
+        the embedding cache are reused and only missing chunks are sent to the embedding model.
+        Returns the embeddings (float32 array) and the number of tokens sent to the embedding model.
 
         @param chunks: Text chunks for which to generate embeddings
+        @param chunk_token_counts: Number of tokens of every chunk if already known (avoids tokenizing again)
+        @param per_chunk_tokens: Whether to return the tokens sent for every chunk (0 for cache hits) instead of their total
         """
+        cached_embeddings = [None] * len(chunks)
+        if self.embedding_cache is not None:
+            for i, chunk in enumerate(chunks):
+                cached = self.embedding_cache.get(self.get_embedding_cache_key(chunk))
+                if cached is not None:
+                    cached_embeddings[i] = np.frombuffer(cached, dtype=np.float32)
+        missing_indices = [i for i, embedding in enumerate(cached_embeddings) if embedding is None]
         embeddings = []
+        embeddings_tokens = 0
         # Split chunks into batches for parallel processing
-        batches = [chunks[i:i + self.embedding_batch_size] for i in range(0, len(chunks), self.embedding_batch_size)]        
+        batches = self.split_into_batches(indices=missing_indices, chunk_token_counts=chunk_token_counts)
         # Create a tqdm progress bar for monitoring
         with concurrent.futures.ThreadPoolExecutor() as executor:
             # Use tqdm to wrap the list of batches being processed
-            batch_embeddings = list(tqdm(executor.map(self.embedding_model.embed_documents, batches), total=len(batches), desc="Generating embeddings"))        
+            batch_embeddings = list(tqdm(executor.map(lambda batch: self.embed_batch(batch=[chunks[i] for i in batch],
+                                                                                     batch_tokens=sum([chunk_token_counts[i] for i in batch]) if chunk_token_counts is not None else None),
+                                                      batches),
+                                         total=len(batches), desc="Generating embeddings"))        
         # Flatten the list of batches
-        for batch in batch_embeddings:
-            embeddings.extend(batch)
-        return np.array(embeddings)
+        chunk_tokens = np.zeros(len(chunks), dtype=np.float64)
+        for batch, (batch_embedding, batch_tokens) in zip(batches, batch_embeddings):
+            embeddings.extend(batch_embedding)
+            embeddings_tokens += batch_tokens
+            if per_chunk_tokens:
+                # Splitting tokens reported for the batch between its chunks by size
+                weights = np.array([chunk_token_counts[i] if chunk_token_counts is not None else len(chunks[i]) for i in batch], dtype=np.float64)
+                chunk_tokens[batch] = batch_tokens * weights / max(weights.sum(), 1)
+        # Merging generated embeddings with cached ones and storing new ones into cache
+        for i, embedding in zip(missing_indices, embeddings):
+            cached_embeddings[i] = np.asarray(embedding, dtype=np.float32)
+            if self.embedding_cache is not None:
+                self.embedding_cache.set(self.get_embedding_cache_key(chunks[i]), cached_embeddings[i].tobytes())
+        return np.array(cached_embeddings, dtype=np.float32), chunk_tokens if per_chunk_tokens else embeddings_tokens
 
     def add_embedded_chunks(self,
-                            chunks):
+                            chunks,
+                            chunk_token_counts=None):
         """
-        Creates the vector stores with corresponding embeddings model and loads the text chunks
+        Creates the vector stores with corresponding embeddings model and loads the text chunks.
+        Returns the number of tokens sent to the embedding model (cache misses only).
 
         @param chunks: Text chunks for which to generate embeddings and to store in vector store
+        @param chunk_token_counts: Number of tokens of every chunk if already known
+        """
+        # Generating embeddings and adding them to the index window by window, so that only one window
+        # of embeddings is held in memory at a time
+        embeddings_tokens = 0
+        window_size = self.embedding_batch_size * EMBEDDING_WINDOW_BATCHES
+        for start in range(0, len(chunks), window_size):
+            window_chunks = chunks[start:start + window_size]
+            window_token_counts = chunk_token_counts[start:start + window_size] if chunk_token_counts is not None else None
+            embeddings, window_tokens = self.generate_embeddings(window_chunks, chunk_token_counts=window_token_counts)
+            if self.index is None:
+                # Index dimension comes from model catalog (from generated embeddings for unknown models)
+                dimension = get_embedding_dimension(self.embedding_model) or embeddings.shape[1]
+                self.index = create_index(dimension=dimension, nb_vectors=len(chunks), backend=self.index_backend)
+            self.index.add(embeddings)
+            self.chunks.extend(window_chunks)
+            embeddings_tokens += window_tokens
+        return embeddings_tokens
+
+    def add_embeddings(self,
+                       chunks,
+                       embeddings):
+        """
+        Loads text chunks with their already generated embeddings (ex: embedded with other documents)
+
+        @param chunks: Text chunks to store in vector store
+        @param embeddings: Embeddings of chunks (float32 array, one row per chunk)
         """
-        # Generating embeddings 
-        embeddings = self.generate_embeddings(chunks)
-        self.vector_store.add_embeddings(text_embeddings=zip(chunks, embeddings))
+        if self.index is None:
+            self.index = create_index(dimension=embeddings.shape[1], nb_vectors=len(chunks), backend=self.index_backend)
+        self.index.add(embeddings)
+        self.chunks.extend(chunks)
 
     def find_relevant_chunks(self,
                              query,
@@ -76,14 +364,75 @@ class VectorStore():
         @param query: Query to use to retrieve document
         @param k: Number of results to retrieve from query        
         """
-        results = self.vector_store.similarity_search(query, k=k)
+        query_vector = self.embedding_model.embed_query(query)
+        return self.find_relevant_chunks_batch(query_vectors=[query_vector], k=k, lambda_mult=1.0)[0]
+
+    def find_relevant_chunks_batch(self,
+                                   query_vectors,
+                                   k=5,
+                                   fetch_k=None,
+                                   lambda_mult=0.5,
+                                   deduplicate=True):
+        """
+        Retrieves relevant and diversified content chunks for many query vectors at once. Candidates of
+        all queries are found with a single vectorized index search, then each query's results are
+        diversified with maximal marginal relevance (MMR). Returns one list of langchain documents per query.
+
+        @param query_vectors: Array of query embeddings (nb_queries x dimension)
+        @param k: Number of results per query (int, or list with one value per query)
+        @param fetch_k: Number of candidates per query fetched before diversification (default 4 x max k)
+        @param lambda_mult: Trade-off between relevance (1.0) and diversity (0.0)
+        @param deduplicate: Whether a chunk can only be returned for one query
+        """
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        ks = [k] * len(query_vectors) if isinstance(k, int) else list(k)
+        nb_vectors = self.index.ntotal if self.index is not None else 0
+        fetch_k = min(fetch_k or 4 * max(ks), nb_vectors)
+        if fetch_k == 0:
+            return [[] for _ in ks]
+        # Single search for all queries
+        _, candidates = self.index.search(query_vectors, fetch_k)
+        unique_ids = np.unique(candidates[candidates >= 0])
+        vectors = dict(zip(unique_ids.tolist(), self.index.reconstruct(unique_ids)))
+        selected_ids = set()
+        results = []
+        for query_vector, query_candidates, query_k in zip(query_vectors, candidates, ks):
+            query_candidates = [i for i in query_candidates.tolist() if i >= 0 and not (deduplicate and i in selected_ids)]
+            if not query_candidates or query_k <= 0:
+                results.append([])
+                continue
+            order = maximal_marginal_relevance(query_vector=query_vector,
+                                               candidate_vectors=np.vstack([vectors[i] for i in query_candidates]),
+                                               k=query_k,
+                                               lambda_mult=lambda_mult)
+            query_ids = [query_candidates[i] for i in order]
+            selected_ids.update(query_ids)
+            results.append([LangchainDocument(page_content=self.chunks[i]) for i in query_ids])
         return results
     
     def save_vector_store(self,
                           path):
         """
-        Saves the generated vector store to a local file
+        Saves the generated vector store to a local directory (same format for every index backend)
 
         @param: Path where to save local vector store        
         """
-        self.vector_store.save_local(path)
\ No newline at end of file
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), self.index.reconstruct(np.arange(self.index.ntotal)))
+        with open(os.path.join(path, "chunks.json"), "w", encoding="utf-8") as file:
+            json.dump(self.chunks, file, ensure_ascii=False)
+        with open(os.path.join(path, "index.json"), "w") as file:
+            json.dump({"dimension": self.index.dimension, "nb_vectors": self.index.ntotal}, file)
+
+    def load_vector_store(self,
+                          path):
+        """
+        Loads a vector store saved with save_vector_store, rebuilding the index backend sized to its number of vectors
+
+        @param path: Path of the local vector store
+        """
+        vectors = np.load(os.path.join(path, "vectors.npy"))
+        with open(os.path.join(path, "chunks.json"), "r", encoding="utf-8") as file:
+            self.chunks = json.load(file)
+        self.index = create_index(dimension=vectors.shape[1], nb_vectors=len(vectors), backend=self.index_backend)
+        self.index.add(vectors)
@@ -1,19 +1,180 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.structures import CaseInsensitiveDict
+from bs4 import BeautifulSoup, FeatureNotFound
+from bs4.element import Tag, NavigableString, CData
 import re
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urldefrag
 import time
+import json
+import struct
+import hashlib
+import threading
+import importlib.util
+import concurrent.futures
+from email.utils import parsedate_to_datetime
 
 from src.exception import WebPageException
 from src.utils import is_content_rich
+from src.cache import hash_key
+
+# Version of the text extraction, part of extracted text cache keys (bump it when extraction changes)
+EXTRACTION_VERSION = 3
+# Number of pooled connections per host of the shared HTTP session
+HTTP_POOL_SIZE = 16
+# Size of the chunks in which page content is streamed
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Links to files that are not web pages are not followed when crawling
+NON_HTML_EXTENSIONS = (".pdf", ".zip", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".mp3", ".mp4", ".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx")
+CRAWL_SCOPES = ["same_host", "same_path"]
+INSUFFICIENT_CONTENT_MESSAGE = "Insufficient quality content extracted from the page. The page may contain mostly navigation, ads, or other non-educational content."
+# Content types of pages that can be parsed (pages without content type are accepted)
+HTML_CONTENT_TYPES = ["text/html", "application/xhtml+xml", "text/plain"]
+
+# lxml (C parser, optional) is much faster than the pure-Python html.parser on large pages
+LXML_AVAILABLE = importlib.util.find_spec("lxml") is not None
+
+def get_html_parser(parser="auto"):
+    """
+    Returns the BeautifulSoup parser to use: "auto" and "lxml" use lxml when it is installed and fall
+    back to the built-in html.parser otherwise
+
+    @param parser: "auto", "lxml" or "html.parser"
+    """
+    if parser in ["auto", "lxml"]:
+        return "lxml" if LXML_AVAILABLE else "html.parser"
+    return "html.parser"
+
+# Shared HTTP session: connections are pooled and kept alive across requests of the same process
+_session = None
+_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Returns the process-wide requests session, creating it on first use
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def get_expiration(headers,
+                   now):
+    """
+    Returns the expiration timestamp of a response from its Cache-Control (or Expires) header, or None
+    if the response must not be stored. Responses without freshness information expire right away
+    (they are revalidated with ETag / Last-Modified on next fetch).
+
+    @param headers: Response headers
+    @param now: Current timestamp
+    """
+    directives = {}
+    for directive in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return now
+    for name in ["s-maxage", "max-age"]:
+        if directives.get(name, "").isdigit():
+            return now + int(directives[name])
+    try:
+        return parsedate_to_datetime(headers["Expires"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return now
+
+class ContentScore():
+    def __init__(self,
+                 text_length=0,
+                 word_count=0,
+                 link_text_length=0,
+                 link_count=0):
+        """
+        Text statistics of an html element, like get_text(strip=True) and find_all("a") on it would give
+
+        @param text_length: Number of characters of the element text (stripped strings)
+        @param word_count: Number of words of the element text
+        @param link_text_length: Number of characters of the text of links in the element
+        @param link_count: Number of links in the element
+        """
+        self.text_length = text_length
+        self.word_count = word_count
+        self.link_text_length = link_text_length
+        self.link_count = link_count
+        self.pruned = False
+
+    @property
+    def link_density(self):
+        return self.link_text_length / self.text_length if self.text_length else 0
+
+def score_content(root,
+                  is_prunable):
+    """
+    Computes the ContentScore of every element under root bottom-up in one traversal (each element
+    sums its own strings and its children scores). Elements for which is_prunable(element, score) is
+    true are marked pruned and excluded from their ancestors scores, as if they had been removed.
+    Returns the scores keyed by element id.
+
+    @param root: Root element
+    @param is_prunable: Function telling if an element should be removed given its score
+    """
+    scores = {}
+    # Iterative post-order traversal (deep pages would exceed the recursion limit)
+    stack = [(root, False)]
+    while stack:
+        element, visited = stack.pop()
+        if not visited:
+            stack.append((element, True))
+            stack.extend((child, False) for child in element.children if isinstance(child, Tag))
+            continue
+        score = ContentScore()
+        for child in element.children:
+            if isinstance(child, Tag):
+                child_score = scores[id(child)]
+                if child_score.pruned:
+                    continue
+                score.text_length += child_score.text_length
+                score.word_count += child_score.word_count
+                score.link_text_length += child_score.link_text_length
+                score.link_count += child_score.link_count
+            elif type(child) in (NavigableString, CData):
+                # Same strings as get_text (comments, doctypes and scripts are skipped)
+                text = child.strip()
+                score.text_length += len(text)
+                score.word_count += len(text.split())
+        if element.name == "a":
+            score.link_text_length = score.text_length
+            score.link_count += 1
+        score.pruned = element is not root and is_prunable(element, score)
+        scores[id(element)] = score
+    return scores
 
 class WebPage():
     def __init__(self,
-                 url):
+                 url,
+                 http_cache=None,
+                 text_cache=None,
+                 parser="auto",
+                 max_page_size_mb=10):
         """
         Web page for which to extract text content         
+
+        @param url: Url of the web page
+        @param http_cache: Cache of http responses honoring ETag / Last-Modified / Cache-Control (None to disable)
+        @param text_cache: Cache of extracted texts keyed by url and page content (None to disable)
+        @param parser: HTML parser backend ("auto", "lxml" or "html.parser")
+        @param max_page_size_mb: Maximum size of the downloaded page in MB, larger pages are rejected
         """
         self.url = url
+        self.http_cache = http_cache
+        self.text_cache = text_cache
+        self.parser = get_html_parser(parser)
+        self.max_page_size = int(max_page_size_mb * 1024 * 1024)
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
@@ -31,22 +192,25 @@ class WebPage():
         except:
             return False
 
-    def _make_request_with_retry(self, url, max_retries=3, timeout=10):
+    def _make_request_with_retry(self, url, max_retries=3, timeout=10, headers=None):
         """Make HTTP request with retry logic and better error handling"""
         for attempt in range(max_retries):
             try:
-                response = requests.get(
+                response = get_http_session().get(
                     url, 
-                    headers=self.headers, 
+                    headers={**self.headers, **(headers or {})}, 
                     timeout=timeout,
                     allow_redirects=True,
-                    verify=True
+                    verify=True,
+                    stream=True
                 )
                 
-                # Handle different status codes
-                if response.status_code == 200:
+                # Handle different status codes (304 answers a conditional request on a cached page)
+                if response.status_code in [200, 304]:
                     return response
-                elif response.status_code == 429:  # Rate limited
+                # Releasing the connection of responses whose body is not read
+                response.close()
+                if response.status_code == 429:  # Rate limited
                     if attempt < max_retries - 1:
                         time.sleep(2 ** attempt)  # Exponential backoff
                         continue
@@ -70,6 +234,73 @@ class WebPage():
         
         raise WebPageException(message="Max retries exceeded")
 
+    def _read_content(self, response):
+        """
+        Reads the body of a streamed response, rejecting non-HTML content and pages larger than
+        max_page_size before downloading them fully
+        """
+        with response:
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type and content_type not in HTML_CONTENT_TYPES:
+                raise WebPageException(message=f"Unsupported content type: {content_type}. Only HTML pages can be processed.")
+            size_error = f"Web page is too large (more than {self.max_page_size // (1024 * 1024)} MB)"
+            content_length = response.headers.get("Content-Length", "")
+            if content_length.isdigit() and int(content_length) > self.max_page_size:
+                raise WebPageException(message=size_error)
+            # Content length may be missing or compressed: the decoded size is checked while streaming
+            chunks, size = [], 0
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_page_size:
+                    raise WebPageException(message=size_error)
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+    def _fetch_content(self):
+        """
+        Fetches the page content through the http cache: fresh cached pages are not requested again and
+        stale ones are revalidated (If-None-Match / If-Modified-Since). Returns the content, its hash and
+        the url it was served from (after redirects, used to resolve relative links).
+        """
+        key = hash_key("http", self.url)
+        cached = self.http_cache.get(key) if self.http_cache is not None else None
+        metadata, content = None, None
+        if cached is not None:
+            # Cached entries are the json metadata (prefixed by its size) followed by the page content
+            metadata_size, = struct.unpack("<I", cached[:4])
+            metadata, content = json.loads(cached[4:4 + metadata_size]), cached[4 + metadata_size:]
+            if time.time() < metadata["expires_at"]:
+                return content, metadata["content_hash"], metadata.get("url", self.url)
+        conditional_headers = {}
+        if metadata is not None and metadata.get("etag"):
+            conditional_headers["If-None-Match"] = metadata["etag"]
+        if metadata is not None and metadata.get("last_modified"):
+            conditional_headers["If-Modified-Since"] = metadata["last_modified"]
+        response = self._make_request_with_retry(self.url, headers=conditional_headers)
+        # Header names are case insensitive (some servers send etag, cache-control, ...)
+        if response.status_code == 304 and content is not None:
+            # Not modified: keeping the cached content with the refreshed freshness information
+            # (validators missing from the 304 response are kept from the cached response)
+            response.close()
+            headers = CaseInsensitiveDict(metadata.get("headers", {}))
+            headers.update(response.headers)
+        else:
+            headers = CaseInsensitiveDict(response.headers)
+            content = self._read_content(response)
+        now = time.time()
+        expires_at = get_expiration(headers, now)
+        content_hash = hashlib.sha256(content).hexdigest()
+        if self.http_cache is not None and expires_at is not None:
+            metadata = {"expires_at": expires_at,
+                        "etag": headers.get("ETag"),
+                        "last_modified": headers.get("Last-Modified"),
+                        "content_hash": content_hash,
+                        "url": response.url,
+                        "headers": {name: headers[name] for name in ["Cache-Control", "Expires", "Content-Type", "ETag", "Last-Modified"] if name in headers}}
+            metadata_bytes = json.dumps(metadata).encode("utf-8")
+            self.http_cache.set(key, struct.pack("<I", len(metadata_bytes)) + metadata_bytes + content)
+        return content, content_hash, response.url
+
     def _remove_irrelevant_content(self, soup):
         """Remove navigation, advertising, and other irrelevant content"""
         # Remove script and style elements
@@ -83,8 +314,9 @@ class WebPage():
             "[role='complementary']", "[role='search']"
         ]
         
-        for selector in nav_selectors:
-            for element in soup.select(selector):
+        # Matching all selectors of a group in a single tree walk
+        for element in soup.select(", ".join(nav_selectors)):
+            if not element.decomposed:
                 element.decompose()
         
         # Remove common advertising and social media elements
@@ -98,8 +330,8 @@ class WebPage():
             "[id*='follow-us']", "[id*='subscribe']", "[id*='newsletter']"
         ]
         
-        for selector in ad_selectors:
-            for element in soup.select(selector):
+        for element in soup.select(", ".join(ad_selectors)):
+            if not element.decomposed:
                 element.decompose()
         
         # Remove forms (contact forms, search forms, etc.)
@@ -117,17 +349,23 @@ class WebPage():
                 aside.decompose()
         
         # Remove elements with very little text content (likely navigation or ads)
-        # But be more lenient for educational content
+        # But be more lenient for educational content. Scores are computed in a single pass and
+        # exclude pruned elements, so they describe the page once these elements are removed.
+        scores = score_content(soup, self._is_navigation_like)
         for element in soup.find_all(["div", "span", "p"]):
-            text = element.get_text(strip=True)
-            if text and len(text) < 10:  # Reduced threshold
-                # Check if it contains mostly links or navigation-like content
-                links = element.find_all("a")
-                if len(links) > len(text.split()) * 0.7:  # More lenient threshold
-                    element.decompose()
-
-    def _extract_main_content(self, soup):
-        """Extract main content using multiple strategies"""
+            if scores[id(element)].pruned and not element.decomposed:
+                element.decompose()
+        return scores
+
+    def _is_navigation_like(self, element, score):
+        """Tell if an element has very little text made mostly of links"""
+        # Reduced threshold, with a more lenient link threshold
+        return (element.name in ["div", "span", "p"]
+                and 0 < score.text_length < 10
+                and score.link_count > score.word_count * 0.7)
+
+    def _extract_main_content(self, soup, scores):
+        """Extract main content using multiple strategies (scores are the precomputed element ContentScores)"""
         # Strategy 1: Look for semantic HTML5 elements
         semantic_selectors = [
             "article", "main", "[role='main']",
@@ -140,7 +378,7 @@ class WebPage():
             elements = soup.select(selector)
             if elements:
                 # Return the largest semantic element
-                main_element = max(elements, key=lambda x: len(x.get_text(strip=True)))
+                main_element = max(elements, key=lambda x: scores[id(x)].text_length)
                 return main_element
         
         # Strategy 2: Look for Wikipedia-specific content
@@ -154,8 +392,8 @@ class WebPage():
         for selector in wikipedia_selectors:
             elements = soup.select(selector)
             if elements:
-                main_element = max(elements, key=lambda x: len(x.get_text(strip=True)))
-                if len(main_element.get_text(strip=True)) > 200:  # Ensure substantial content
+                main_element = max(elements, key=lambda x: scores[id(x)].text_length)
+                if scores[id(main_element)].text_length > 200:  # Ensure substantial content
                     return main_element
         
         # Strategy 3: Find the div with the most text content
@@ -164,16 +402,14 @@ class WebPage():
             # Filter out divs that are likely navigation or ads
             content_divs = []
             for div in divs:
-                text = div.get_text(strip=True)
-                if len(text) > 100:  # Minimum content length
+                score = scores[id(div)]
+                if score.text_length > 100:  # Minimum content length
                     # Check if it's not mostly links
-                    links = div.find_all("a")
-                    link_text_ratio = sum(len(link.get_text(strip=True)) for link in links) / len(text) if text else 0
-                    if link_text_ratio < 0.4:  # Less than 40% links (more lenient)
+                    if score.link_density < 0.4:  # Less than 40% links (more lenient)
                         content_divs.append(div)
             
             if content_divs:
-                return max(content_divs, key=lambda x: len(x.get_text(strip=True)))
+                return max(content_divs, key=lambda x: scores[id(x)].text_length)
         
         # Strategy 4: Fallback to body content
         return soup.find("body") or soup
@@ -196,27 +432,48 @@ class WebPage():
         
         return text.strip()
 
-    def extract_text(self):
+    def _extract_links(self, soup, base_url):
+        """Extract absolute urls (without fragment) of the http(s) links of the page, in page order"""
+        base = soup.find("base", href=True)
+        base_url = urljoin(base_url, base["href"]) if base else base_url
+        links = []
+        for anchor in soup.find_all("a", href=True):
+            link = urldefrag(urljoin(base_url, anchor["href"].strip())).url
+            if urlparse(link).scheme in ["http", "https"]:
+                links.append(link)
+        return list(dict.fromkeys(links))
+
+    def extract_page(self):
         """
-        Extracts the text from a web page by scraping page and parsing html
-        content to get relevant text        
+        Extracts the cleaned text of a web page and the urls of its links (collected before navigation
+        elements are removed, so that tables of contents and pagination are kept). The text is not
+        checked for content quality.
         """
         # Validate URL
         if not self._is_valid_url(self.url):
             raise WebPageException(message="Invalid URL format")
         
         try:
-            # Make request with retry logic
-            response = self._make_request_with_retry(self.url)
+            # Fetch page (shared session, http cache) and reuse its extraction if the page did not change
+            content, content_hash, base_url = self._fetch_content()
+            page_key = hash_key("page", self.url, content_hash, EXTRACTION_VERSION, self.parser)
+            cached_page = self.text_cache.get_json(page_key) if self.text_cache is not None else None
+            if cached_page is not None:
+                return cached_page["text"], cached_page["links"]
             
             # Parse HTML content
-            soup = BeautifulSoup(response.content, "html.parser")
+            try:
+                soup = BeautifulSoup(content, self.parser)
+            except FeatureNotFound:
+                # Parser backend not usable in this environment
+                soup = BeautifulSoup(content, "html.parser")
+            links = self._extract_links(soup, base_url)
             
             # Remove irrelevant content
-            self._remove_irrelevant_content(soup)
+            scores = self._remove_irrelevant_content(soup)
             
             # Extract main content
-            main_content = self._extract_main_content(soup)
+            main_content = self._extract_main_content(soup, scores)
             
             if not main_content:
                 raise WebPageException(message="No main content found on the page")
@@ -225,14 +482,108 @@ class WebPage():
             text = main_content.get_text(separator="\n", strip=True)
             text = self._clean_text(text)
             
-            # Validate content quality
-            if not is_content_rich(text, min_length=200, min_sentences=3):
-                raise WebPageException(message="Insufficient quality content extracted from the page. The page may contain mostly navigation, ads, or other non-educational content.")
-            
-            return text
+            if self.text_cache is not None:
+                self.text_cache.set_json(page_key, {"text": text, "links": links})
+            return text, links
             
         except WebPageException:
             raise
         except Exception as e:
             raise WebPageException(message=f"Unexpected error during content extraction: {str(e)}")
 
+    def extract_text(self):
+        """
+        Extracts the text from a web page by scraping page and parsing html
+        content to get relevant text        
+        """
+        text, _ = self.extract_page()
+        
+        # Validate content quality
+        if not is_content_rich(text, min_length=200, min_sentences=3):
+            raise WebPageException(message=INSUFFICIENT_CONTENT_MESSAGE)
+        
+        return text
+
+
+class WebCrawler():
+    def __init__(self,
+                 url,
+                 max_depth=1,
+                 max_pages=10,
+                 workers=4,
+                 scope="same_host",
+                 **page_settings):
+        """
+        Crawls a web page and the pages it links to (course chapters, paginated or table of contents pages)
+        level by level, fetching the pages of a level concurrently
+
+        @param url: Url of the first page
+        @param max_depth: Maximum number of links followed from the first page (0 fetches the first page only)
+        @param max_pages: Maximum number of pages fetched
+        @param workers: Number of pages fetched at the same time
+        @param scope: Links followed: "same_host" (pages of the first page host) or "same_path" (pages under the first page directory)
+        @param page_settings: Keyword arguments of every WebPage (caches, parser, max_page_size_mb)
+        """
+        self.url = url
+        self.max_depth = max_depth
+        self.max_pages = max(1, max_pages)
+        self.workers = max(1, workers)
+        self.scope = scope
+        self.page_settings = page_settings
+        parsed_url = urlparse(url)
+        self.host = self._normalize_host(parsed_url.netloc)
+        self.path_prefix = parsed_url.path[:parsed_url.path.rfind("/") + 1] or "/"
+
+    def _normalize_host(self, netloc):
+        """Normalize host so that www. and non-www. urls are on the same host"""
+        netloc = netloc.lower()
+        return netloc[4:] if netloc.startswith("www.") else netloc
+
+    def is_in_scope(self,
+                    url):
+        """
+        Tells if a link should be followed
+
+        @param url: Absolute url of the link
+        """
+        parsed_url = urlparse(url)
+        if self._normalize_host(parsed_url.netloc) != self.host:
+            return False
+        if parsed_url.path.lower().endswith(NON_HTML_EXTENSIONS):
+            return False
+        return self.scope != "same_path" or parsed_url.path.startswith(self.path_prefix)
+
+    def crawl(self):
+        """
+        Returns the texts of crawled pages with enough content, in crawl order (first page, then pages
+        linked from it, ...). Errors of linked pages are skipped, errors of the first page are raised.
+        """
+        def extract_page(url):
+            try:
+                return WebPage(url=url, **self.page_settings).extract_page()
+            except WebPageException:
+                if url == self.url:
+                    raise
+                return None, []
+
+        seen_urls = {self.url}
+        level_urls = [self.url]
+        texts = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for depth in range(self.max_depth + 1):
+                next_level_urls = []
+                # Pages of a level are fetched concurrently, results are kept in link order
+                for text, links in executor.map(extract_page, level_urls):
+                    if text is not None and is_content_rich(text, min_length=200, min_sentences=3):
+                        texts.append(text)
+                    if depth < self.max_depth:
+                        for link in links:
+                            if link not in seen_urls and len(seen_urls) < self.max_pages and self.is_in_scope(link):
+                                seen_urls.add(link)
+                                next_level_urls.append(link)
+                if not next_level_urls:
+                    break
+                level_urls = next_level_urls
+        if not texts:
+            raise WebPageException(message=INSUFFICIENT_CONTENT_MESSAGE)
+        return texts
@@ -0,0 +1,31 @@
+import os
+
+from src.cache import DiskBudget, VectorStoreRegistry, VECTOR_STORE_MARKER
+
+
+def write_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(b"\0" * size)
+
+
+def save_store(size):
+    def save_function(path):
+        write_file(os.path.join(path, "vectors.npy"), size)
+        write_file(os.path.join(path, VECTOR_STORE_MARKER), 10)
+    return save_function
+
+
+def test_registry_never_evicts_foreign_directories(tmp_path):
+    # A directory the registry did not create, larger than the whole budget
+    foreign_file = tmp_path / "important_project" / "data.bin"
+    write_file(str(foreign_file), 3 * 1024 * 1024)
+    registry = VectorStoreRegistry(root_dir=str(tmp_path), disk_budget=DiskBudget(max_size_mb=2))
+    for i in range(3):
+        registry.save(path=registry.get_path(fingerprint=f"doc{i}", embedding_model_name="model"),
+                      save_function=save_store(size=900 * 1024))
+
+    assert foreign_file.exists()
+    stores = sorted(name for name in os.listdir(tmp_path) if name.startswith("model-"))
+    # Least recently used stores are evicted to fit the budget
+    assert stores == ["model-doc1", "model-doc2"]
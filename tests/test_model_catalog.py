@@ -0,0 +1,11 @@
+from types import SimpleNamespace
+
+from src.model_catalog import get_embedding_model_key
+
+
+def test_embedding_model_key_separates_shortened_vectors():
+    full = SimpleNamespace(model="text-embedding-3-small", dimensions=None)
+    shortened = SimpleNamespace(model="text-embedding-3-small", dimensions=256)
+
+    assert get_embedding_model_key(full) == "text-embedding-3-small"
+    assert get_embedding_model_key(shortened) == "text-embedding-3-small-256d"